@@ -0,0 +1,112 @@
+from __future__ import annotations
+import queue
+import threading
+import time
+from typing import Optional
+
+from constants import *
+
+
+class AutoSaver:
+    """
+    Periodically saves the project on a worker thread. The main thread only takes
+    a copy of the project; serialization and the atomic write happen on the worker. Saves are
+    skipped while the project revision has not changed since the last one. The
+    worker reports failed saves through a queue that poll() reads, so the save
+    state is only changed on the main thread.
+    """
+    def __init__(self, app: App, interval: float = AUTOSAVE_INTERVAL) -> None:
+        self.app = app
+        self.interval = interval
+        self.queue = queue.Queue(maxsize=1)
+        self.failures = queue.Queue()
+        self.thread = None
+        self.queued_revision = app.invalidator.revision
+        self.saved_revision = app.invalidator.revision
+        self.last_request = time.monotonic()
+        self.saves = 0
+        self.last_duration = 0.0
+
+    def start(self) -> None:
+        """
+        Starts the worker thread.
+        """
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._work, name='autosave', daemon=True)
+            self.thread.start()
+
+    def stop(self) -> None:
+        """
+        Saves any pending changes and waits for the worker to finish.
+        """
+        if self.thread is None:
+            return
+        self.request(block=True)
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def mark_saved(self) -> None:
+        """
+        Treats the current revision as saved, e.g. right after a project was loaded.
+        """
+        self.queued_revision = self.app.invalidator.revision
+        self.saved_revision = self.app.invalidator.revision
+
+    def pending(self) -> bool:
+        """
+        Returns whether the project changed since the last queued save.
+        """
+        return self.app.invalidator.revision != self.queued_revision
+
+    def seconds_until_due(self) -> Optional[float]:
+        """
+        Returns the time until the next save is due, or None if there is nothing to save.
+        """
+        if not self.pending():
+            return None
+        return max(0.0, self.last_request + self.interval - time.monotonic())
+
+    def poll(self) -> None:
+        """
+        Called from the main loop; hands a copy of the project to the worker when a
+        save is due. A failed save is retried with the next one.
+        """
+        while not self.failures.empty():
+            if self.failures.get() == self.queued_revision:
+                self.queued_revision = None
+        if self.seconds_until_due() == 0.0:
+            self.request()
+
+    def request(self, block: bool = False) -> None:
+        """
+        Queues a copy of the current project unless nothing changed or the
+        worker is still busy with the previous one.
+        """
+        if not self.pending():
+            return
+        revision = self.app.invalidator.revision
+        item = (revision, self.app.autosave_path(), self.app.project.copy())
+        try:
+            self.queue.put(item, block=block)
+        except queue.Full:
+            return
+        self.queued_revision = revision
+        self.last_request = time.monotonic()
+
+    def _work(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            revision, file_path, project = item
+            start = time.perf_counter()
+            try:
+                data = self.app.file_io.serialize_project(project, binary=file_path.endswith('.chp'))
+                self.app.file_io.write_atomic(file_path, data)
+                self.saved_revision = revision
+                self.saves += 1
+            except (OSError, ValueError) as e:
+                print(f'Could not autosave: {e}')
+                self.failures.put(revision)
+            self.last_duration = time.perf_counter() - start
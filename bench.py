@@ -0,0 +1,295 @@
+"""
+Headless benchmark suite for the codec, render and export hot paths. Runs on
+data/sample.chr and data/sample.json and on a synthetic large project: a 128 KB
+CHR file (32 banks) and 256 metatiles spread over all banks, 256 metametatiles
+and 1024 rooms.
+
+    python3 bench.py --out results.json
+    python3 bench.py --baseline results.json --threshold 0.25
+    python3 bench.py --filter large/frame
+
+Every benchmark is run in batches sized by timeit's autorange, and the best
+and median time per call are saved as JSON. With --baseline, benchmarks that
+got slower than the baseline by more than the threshold are listed and the
+run exits with status 1. Before timing anything, the CHR codec is checked to
+round-trip random data; the run exits with status 1 if it does not.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import timeit
+
+from contextlib import redirect_stdout
+from typing import Callable, Dict, List, Tuple
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import numpy as np
+import pygame
+
+from chr_banks import BANK_BYTES, ChrBanks
+from constants import *
+from entities import colorize
+from header_export import HeaderExporter
+from main import App
+from project import Project
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+SAMPLE_CHR = os.path.join(DATA_DIR, 'sample.chr')
+SAMPLE_PROJECT = os.path.join(DATA_DIR, 'sample.json')
+FRAME_MODES = ['tiles', 'metatiles', 'metametatiles', 'rooms', 'map', 'overview']
+
+
+def synthetic_project(banks: int = 32, seed: int = 0) -> Project:
+    """
+    Returns a project with the largest tables and random valid references.
+    """
+    rng = np.random.default_rng(seed)
+    project = Project.empty(MAX_METATILES, MAX_METAMETATILES, MAX_ROOMS)
+    project.metatiles[:] = rng.integers(0, 256, project.metatiles.shape)
+    project.metatile_palettes[:] = rng.integers(0, 4, project.metatile_palettes.shape)
+    project.metatile_banks[:] = rng.integers(0, banks, project.metatile_banks.shape)
+    project.metametatiles[:] = rng.integers(0, MAX_METATILES, project.metametatiles.shape)
+    project.rooms[:] = rng.integers(0, MAX_METAMETATILES, project.rooms.shape)
+    return project
+
+
+def write_synthetic_chr(file_path: str, banks: int = 32, seed: int = 0) -> None:
+    """
+    Writes a CHR file of random tiles, 4 KB per bank.
+    """
+    rng = np.random.default_rng(seed)
+    with open(file_path, 'wb') as file:
+        file.write(rng.integers(0, 256, banks * BANK_BYTES, dtype=np.uint8).tobytes())
+
+
+def decode_banks(file_io, chr_path: str) -> None:
+    """
+    Maps a CHR file and decodes every bank, as browsing all banks in the editor does.
+    """
+    banks = ChrBanks.open(file_io, chr_path)
+    for index in range(len(banks)):
+        banks.table(index)
+    banks.close()
+
+
+def check_round_trip(file_io, folder: str, files: int = 20, seed: int = 0) -> List[str]:
+    """
+    Writes random 8 KB CHR files, reads them with read_file and writes them back
+    with write_file, and a random multi-bank file through ChrBanks. Returns a
+    line for every file that did not come back byte for byte.
+    """
+    rng = np.random.default_rng(seed)
+    chr_path = os.path.join(folder, 'round_trip.chr')
+    out_path = os.path.join(folder, 'round_trip_out.chr')
+    failures = []
+    for i in range(files):
+        data = rng.integers(0, 256, 2 * BANK_BYTES, dtype=np.uint8).tobytes()
+        with open(chr_path, 'wb') as file:
+            file.write(data)
+        with redirect_stdout(io.StringIO()):
+            table_a, table_b = file_io.read_file(chr_path)
+        if file_io.to_binary(table_a) + file_io.to_binary(table_b) != data:
+            failures.append(f'to_binary(read_file(x)) != x for random file {i}')
+        file_io.write_file(out_path, table_a, table_b)
+        with open(out_path, 'rb') as file:
+            if file.read() != data:
+                failures.append(f'write_file(read_file(x)) != x for random file {i}')
+
+    write_synthetic_chr(chr_path, banks=5, seed=seed)
+    banks = ChrBanks.open(file_io, chr_path)
+    with redirect_stdout(io.StringIO()):
+        for index in range(0, len(banks), 2):
+            banks.table(index)
+    banks.save(out_path)
+    banks.close()
+    with open(chr_path, 'rb') as original, open(out_path, 'rb') as saved:
+        if original.read() != saved.read():
+            failures.append('ChrBanks.save changed a partly decoded multi-bank file')
+    return failures
+
+
+def measure(function: Callable, repeat: int) -> Dict[str, float]:
+    """
+    Times a function and returns the best and median seconds per call.
+    """
+    with redirect_stdout(io.StringIO()):
+        timer = timeit.Timer(function)
+        number, _ = timer.autorange()
+        times = [seconds / number for seconds in timer.repeat(repeat, number)]
+    return {'best': min(times), 'median': statistics.median(times), 'number': number}
+
+
+class Suite:
+    """
+    Builds the benchmarks of one dataset on a headless App.
+    """
+    def __init__(self, app: App, name: str, chr_path: str, project: Project, folder: str) -> None:
+        self.app = app
+        self.name = name
+        self.chr_path = chr_path
+        self.project = project
+        self.folder = os.path.join(folder, name)
+        os.makedirs(self.folder)
+        self.exports = 0
+
+    def load(self) -> None:
+        """
+        Puts the dataset into the app with every render invalidated, opening the
+        CHR file as the editor does.
+        """
+        app = self.app
+        app.project = self.project
+        app.chr_banks.close()
+        app.chr_banks = ChrBanks.open(app.file_io, self.chr_path)
+        with redirect_stdout(io.StringIO()):
+            app.project.table_a, app.project.table_b = app.chr_banks.table(0), app.chr_banks.table(1)
+        app.history.clear()
+        app.update_palette_lut()
+        app.bind_tables()
+        app.invalidator.mark_all()
+
+    def frame(self, mode: str, cold: bool) -> Callable:
+        """
+        Returns a function drawing one frame in the given mode, with every sprite
+        re-rendered (cold) or from the cached images (warm).
+        """
+        switch = getattr(self.app, f'switch_mode_{mode}')
+
+        def draw() -> None:
+            if self.app.mode != mode:
+                switch()
+                self.app.draw()
+            if cold:
+                self.app.invalidator.mark_all()
+            self.app.draw()
+        return draw
+
+    def update_arr(self, sprite, cold: bool) -> Callable:
+        """
+        Returns a function recomposing one sprite, with an empty (cold) or a warm tile cache.
+        """
+        def update() -> None:
+            if cold:
+                self.app.tile_cache.clear()
+            sprite.update_arr()
+        return update
+
+    def write_headers(self) -> None:
+        """
+        Writes every header into a new folder, as an export to a fresh destination does.
+        """
+        self.exports += 1
+        folder = os.path.join(self.folder, f'headers_{self.exports}')
+        os.makedirs(folder)
+        HeaderExporter(self.app.file_io).write(folder, self.app.project)
+
+    def benchmarks(self) -> List[Tuple[str, Callable]]:
+        app = self.app
+        file_io = app.file_io
+        renderer = app.ui_renderer
+        json_path = os.path.join(self.folder, 'project.json')
+        chp_path = os.path.join(self.folder, 'project.chp')
+        unchanged = os.path.join(self.folder, 'headers')
+        os.makedirs(unchanged)
+        HeaderExporter(file_io).write(unchanged, app.project)
+        file_io.write_project(json_path, app.project)
+        file_io.write_project(chp_path, app.project)
+
+        return [
+            ('ChrBanks.open', lambda: ChrBanks.open(file_io, self.chr_path).close()),
+            ('decode banks', lambda: decode_banks(file_io, self.chr_path)),
+            ('to_binary', lambda: file_io.to_binary(app.project.table_a)),
+            ('colorize', lambda: colorize(app.project.table_a, app.palette_lut, 0)),
+            ('MetaTile.update_arr cold', self.update_arr(renderer.metatile_sprites[0], True)),
+            ('MetaTile.update_arr warm', self.update_arr(renderer.metatile_sprites[0], False)),
+            ('MetaMetaTile.update_arr cold', self.update_arr(renderer.metametatile_sprites[0], True)),
+            ('MetaMetaTile.update_arr warm', self.update_arr(renderer.metametatile_sprites[0], False)),
+            ('Room.update_arr', self.update_arr(renderer.room_sprite, False)),
+        ] + [
+            (f'frame {mode} {"cold" if cold else "warm"}', self.frame(mode, cold))
+            for mode in FRAME_MODES for cold in [True, False]
+        ] + [
+            ('export json', lambda: file_io.write_project(json_path, app.project)),
+            ('export chp', lambda: file_io.write_project(chp_path, app.project)),
+            ('import_data json', lambda: app.load_project(json_path)),
+            ('import_data chp', lambda: app.load_project(chp_path)),
+            ('write_to_file', self.write_headers),
+            ('write_to_file unchanged', lambda: HeaderExporter(file_io).write(unchanged, app.project)),
+        ]
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[str]:
+    """
+    Returns a line for every benchmark whose best time exceeds the baseline by more than threshold.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name in baseline:
+            ratio = result['best'] / max(baseline[name]['best'], 1e-12)
+            if ratio > 1 + threshold:
+                regressions.append(f'{name}: {baseline[name]["best"] * 1000:.3f} ms -> '
+                                   f'{result["best"] * 1000:.3f} ms ({ratio:.2f}x)')
+    return regressions
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the codec, render and export hot paths.')
+    parser.add_argument('--out', default='bench_results.json', help='file to save the results to')
+    parser.add_argument('--baseline', help='results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='fail if a benchmark is slower than the baseline by more than this fraction')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timed batches per benchmark')
+    parser.add_argument('--filter', default='', help='only run benchmarks whose name contains this text')
+    args = parser.parse_args(argv)
+
+    app = App()
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        failures = check_round_trip(app.file_io, folder)
+        if failures:
+            print('CHR round trip failed:')
+            print('\n'.join(f'  {line}' for line in failures))
+            pygame.quit()
+            return 1
+        print('CHR round trip: OK')
+        large_chr = os.path.join(folder, 'large.chr')
+        write_synthetic_chr(large_chr)
+        with redirect_stdout(io.StringIO()):
+            sample = app.file_io.read_project(SAMPLE_PROJECT)
+        for suite in [Suite(app, 'sample', SAMPLE_CHR, sample, folder),
+                      Suite(app, 'large', large_chr, synthetic_project(), folder)]:
+            suite.load()
+            for name, function in suite.benchmarks():
+                name = f'{suite.name}/{name}'
+                if args.filter in name:
+                    results[name] = measure(function, args.repeat)
+                    print(f'{name:40} {results[name]["best"] * 1000:9.3f} ms '
+                          f'(median {results[name]["median"] * 1000:.3f} ms)')
+    pygame.quit()
+
+    with open(args.out, 'w') as file:
+        json.dump({'python': platform.python_version(), 'numpy': np.__version__,
+                   'pygame': pygame.version.ver, 'results': results}, file, indent=2)
+    print(f'Saved results to {args.out}')
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file)['results'], args.threshold)
+        if regressions:
+            print(f'{len(regressions)} regressions over {args.threshold:.0%}:')
+            print('\n'.join(f'  {line}' for line in regressions))
+            return 1
+        print(f'No regressions over {args.threshold:.0%}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
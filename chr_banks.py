@@ -0,0 +1,166 @@
+from __future__ import annotations
+import mmap
+import time
+from typing import Dict
+
+import numpy as np
+
+from file_io import FileIO, TILE_BYTES, TILES_PER_TABLE
+
+
+BANK_BYTES = TILE_BYTES * TILES_PER_TABLE
+
+
+class ChrBanks:
+    """
+    The 4 KB banks (pattern tables) of a CHR file of any size. The file is
+    memory-mapped and a bank is only decoded into a 128x128 table the first time
+    it is accessed; decoded tables are kept and edited in place. The decode time
+    of the banks of a file adds up in file_io.decode_stats. Banks 0 and 1
+    are the project's table_a and table_b (see bind). Banks past the end of the
+    file read as empty tables.
+    """
+    def __init__(self, file_io: FileIO, data=None, count: int = 2) -> None:
+        self.file_io = file_io
+        self.data = data
+        self.count = max(count, 2)
+        self.tables: Dict[int, np.ndarray] = {}
+        self.empty = np.zeros((128, 128), dtype=np.uint8)
+        self.file = None
+        self.path = None
+
+    @classmethod
+    def open(cls, file_io: FileIO, file_path: str) -> ChrBanks:
+        """
+        Maps a CHR file without reading or decoding any of it.
+        """
+        banks = cls(file_io)
+        size = banks.map(file_path)
+        file_io.decode_stats = {'bytes': 0, 'tiles': 0, 'seconds': 0.0, 'mb_per_s': 0.0}
+        banks.count = max(-(-size // BANK_BYTES), 2)
+        return banks
+
+    def map(self, file_path: str) -> int:
+        """
+        Memory-maps a CHR file as the source of the banks not decoded yet and
+        returns its size.
+        """
+        file = open(file_path, 'rb')
+        try:
+            size = file.seek(0, 2)
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        except BaseException:
+            file.close()
+            raise
+        self.file = file
+        self.path = file_path
+        return size
+
+    @classmethod
+    def from_tables(cls, file_io: FileIO, table_a: np.ndarray, table_b: np.ndarray) -> ChrBanks:
+        """
+        Returns two banks holding the given tables, e.g. those stored in a project.
+        """
+        banks = cls(file_io)
+        banks.bind(table_a, table_b)
+        return banks
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        return self.table(index)
+
+    def table(self, index: int) -> np.ndarray:
+        """
+        Returns the decoded table of a bank, decoding it on first access.
+        """
+        index = int(index)
+        table = self.tables.get(index)
+        if table is not None:
+            return table
+        if not 0 <= index < self.count:
+            return self.empty
+        raw = self.raw(index)
+        raw = raw[:len(raw) // TILE_BYTES * TILE_BYTES]
+        start = time.perf_counter()
+        tiles = self.file_io.decode_tiles(raw)
+        table = self.file_io.tiles_to_table(tiles)
+        elapsed = time.perf_counter() - start
+        self.tables[index] = table
+        self.report_decode(index, len(raw), len(tiles), elapsed)
+        return table
+
+    def report_decode(self, index: int, size: int, tiles: int, seconds: float) -> None:
+        """
+        Adds a decoded bank to file_io.decode_stats and prints its throughput.
+        """
+        stats = self.file_io.decode_stats
+        stats['bytes'] += size
+        stats['tiles'] += tiles
+        stats['seconds'] += seconds
+        stats['mb_per_s'] = stats['bytes'] / (1024 * 1024) / stats['seconds'] if stats['seconds'] > 0 else float('inf')
+        mb_per_s = size / (1024 * 1024) / seconds if seconds > 0 else float('inf')
+        print(f'Decoded bank {index}: {tiles} tiles ({size / 1024:.1f} KB) '
+              f'in {seconds * 1000:.2f} ms ({mb_per_s:.1f} MB/s)')
+
+    def raw(self, index: int) -> bytes:
+        """
+        Returns the undecoded bytes of a bank as stored in the file.
+        """
+        if self.data is None:
+            return b''
+        return self.data[index * BANK_BYTES:(index + 1) * BANK_BYTES]
+
+    def bind(self, table_a: np.ndarray, table_b: np.ndarray) -> None:
+        """
+        Makes banks 0 and 1 the given tables, so that editing either edits the other.
+        """
+        self.tables[0] = table_a
+        self.tables[1] = table_b
+
+    def decoded(self) -> int:
+        """
+        Returns the number of banks decoded so far.
+        """
+        return len(self.tables)
+
+    def to_bytes(self) -> bytes:
+        """
+        Encodes every bank back into CHR data. Banks that were never decoded are
+        copied from the file as they are.
+        """
+        chunks = []
+        for index in range(self.count):
+            if index in self.tables:
+                chunks.append(self.file_io.to_binary(self.tables[index]))
+            else:
+                chunks.append(self.raw(index).ljust(BANK_BYTES, b'\0'))
+        return b''.join(chunks)
+
+    def save(self, file_path: str) -> None:
+        """
+        Writes every bank to a CHR file and maps that file. The mapping is closed
+        while writing, as a mapped file cannot be replaced on every platform, and
+        the file is replaced atomically. Decoded banks are kept as they are.
+        """
+        data = self.to_bytes()
+        path = self.path
+        self.close()
+        try:
+            self.file_io.write_atomic(file_path, data)
+            path = file_path
+        finally:
+            if path is not None:
+                self.map(path)
+
+    def close(self) -> None:
+        """
+        Unmaps the file. Decoded banks stay available.
+        """
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,311 @@
+"""
+Headless command-line interface: exports C headers and renders PNG previews
+of projects without opening a window.
+
+    python3 cli.py data/sample.json --out build
+    python3 cli.py projects/ --chr data/sample.chr --rooms 0,1,2 --scale 2
+    python3 cli.py data/sample.json --convert chp
+    python3 cli.py data/sample.json --resize 256,128,200 --convert chp
+"""
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import time
+
+from contextlib import contextmanager
+from typing import Dict, List
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import numpy as np
+import pygame
+
+import composer
+from chr_banks import ChrBanks
+from constants import *
+from entities import build_palette_lut
+from compression import CODECS, compare
+from file_io import FileIO
+from optimizer import optimize
+from header_export import HeaderExporter
+from project import Project
+from tile_cache import TileCache
+
+
+class HeadlessRenderer:
+    """
+    Renders a project without a window. Rooms and sheets are composed by the
+    vectorized composer; the tile cache is kept for comparing against the
+    editor's per-sprite path. Without banks, the project's two pattern tables
+    are the only CHR banks.
+    """
+    def __init__(self, project: Project, chr_banks: ChrBanks = None) -> None:
+        self.project = project
+        self.chr_banks = chr_banks or ChrBanks.from_tables(FileIO(), project.table_a, project.table_b)
+        self.palette_lut = build_palette_lut(project.palettes)
+        self.tile_cache = TileCache(self)
+
+    def render_room(self, index: int) -> np.ndarray:
+        """
+        Renders a room as a (256, 192, 3) array.
+        """
+        return composer.compose_rooms(self.project, self.palette_lut, self.project.rooms[index], self.chr_banks)
+
+    def render_rooms(self, indices: List[int]) -> np.ndarray:
+        """
+        Renders several rooms in one call as an (n, 256, 192, 3) array.
+        """
+        return composer.compose_rooms(self.project, self.palette_lut, self.project.rooms[indices], self.chr_banks)
+
+    def render_metatile_sheet(self, columns: int = 6) -> np.ndarray:
+        """
+        Renders all metatiles in a grid, in the same order as the editor panel.
+        """
+        indices = composer.metatile_indices(self.project, np.arange(len(self.project.metatiles)), self.chr_banks)
+        return self._sheet(composer.to_rgb(indices, self.palette_lut), columns)
+
+    def render_metametatile_sheet(self, columns: int = 6) -> np.ndarray:
+        """
+        Renders all metametatiles in a grid, in the same order as the editor panel.
+        """
+        indices = composer.metametatile_indices(self.project, np.arange(len(self.project.metametatiles)),
+                                                self.chr_banks)
+        return self._sheet(composer.to_rgb(indices, self.palette_lut), columns)
+
+    def _sheet(self, images: np.ndarray, columns: int) -> np.ndarray:
+        size = images[0].shape[0]
+        rows = -(-len(images) // columns)
+        sheet = np.zeros((columns * size, rows * size, 3), dtype=np.uint8)
+        for i, image in enumerate(images):
+            x = i % columns * size
+            y = i // columns * size
+            sheet[x:x+size, y:y+size] = image
+        return sheet
+
+
+class StageTimer:
+    """
+    Accumulates wall-clock time per named stage.
+    """
+    def __init__(self) -> None:
+        self.times: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] = self.times.get(name, 0.0) + time.perf_counter() - start
+
+    def report(self, title: str) -> str:
+        stages = ', '.join(f'{name} {seconds * 1000:.1f} ms' for name, seconds in self.times.items())
+        return f'{title}: {stages} (total {sum(self.times.values()) * 1000:.1f} ms)'
+
+
+def save_png(arr: np.ndarray, file_path: str, scale: int = 1) -> None:
+    """
+    Saves an (x, y, 3) array as PNG, enlarged by an integer factor.
+    """
+    if scale > 1:
+        arr = arr.repeat(scale, axis=0).repeat(scale, axis=1)
+    pygame.image.save(pygame.surfarray.make_surface(arr), file_path)
+
+
+def parse_rooms(value: str, count: int) -> List[int]:
+    """
+    Parses the --rooms argument: 'all' or a comma-separated list of indices.
+    """
+    if value == 'all':
+        return list(range(count))
+    return [int(index) for index in value.split(',') if index]
+
+
+def parse_sizes(value: str) -> List[int]:
+    """
+    Parses the --resize argument: metatile, metametatile and room counts.
+    """
+    sizes = [int(size) for size in value.split(',')]
+    if len(sizes) != 3:
+        raise argparse.ArgumentTypeError('expected three counts: metatiles,metametatiles,rooms')
+    return sizes
+
+
+def bench_project_io(project: Project, file_io: FileIO, repeat: int = 20) -> None:
+    """
+    Times saving and loading the project in both the JSON and the binary format.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        for extension in ['json', 'chp']:
+            file_path = os.path.join(folder, f'project.{extension}')
+            start = time.perf_counter()
+            for _ in range(repeat):
+                file_io.write_project(file_path, project)
+            save_time = (time.perf_counter() - start) / repeat
+            start = time.perf_counter()
+            for _ in range(repeat):
+                file_io.read_project(file_path)
+            load_time = (time.perf_counter() - start) / repeat
+            print(f'  {extension}: {os.path.getsize(file_path)} bytes, '
+                  f'save {save_time * 1000:.2f} ms, load {load_time * 1000:.2f} ms')
+
+
+def bench_render(renderer: HeadlessRenderer, repeat: int = 5) -> None:
+    """
+    Times composing every room through the tile cache, one room at a time, and
+    through the composer, one room at a time and all rooms in a single call.
+    """
+    rooms = renderer.project.rooms
+    indices = list(range(len(rooms)))
+    timings = []
+    for label, render in [('tile cache', lambda: [renderer.tile_cache.compose_room(room) for room in rooms]),
+                          ('composer', lambda: [renderer.render_room(index) for index in indices]),
+                          ('composer, one call', lambda: renderer.render_rooms(indices))]:
+        renderer.tile_cache.clear()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            render()
+        timings.append((label, (time.perf_counter() - start) / repeat))
+    baseline = timings[0][1]
+    for label, seconds in timings:
+        print(f'  {label}: {len(rooms)} rooms in {seconds * 1000:.2f} ms '
+              f'({seconds * 1000 / len(rooms):.3f} ms per room, {baseline / max(seconds, 1e-9):.1f}x)')
+
+
+def find_projects(paths: List[str]) -> List[str]:
+    """
+    Expands directories into the project files (JSON or binary) they contain.
+    """
+    projects = []
+    for path in paths:
+        if os.path.isdir(path):
+            projects += sorted(glob.glob(os.path.join(path, '*.json')) + glob.glob(os.path.join(path, '*.chp')))
+        else:
+            projects.append(path)
+    return projects
+
+
+def process(file_path: str, args: argparse.Namespace, file_io: FileIO, totals: StageTimer) -> None:
+    """
+    Runs the requested stages for one project.
+    """
+    timer = StageTimer()
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    out_dir = os.path.join(args.out, name)
+    os.makedirs(out_dir, exist_ok=True)
+
+    chr_banks = None
+    try:
+        with timer.stage('load'):
+            project = file_io.read_project(file_path)
+            if args.chr:
+                chr_banks = ChrBanks.open(file_io, args.chr)
+                project.table_a, project.table_b = chr_banks.table(0), chr_banks.table(1)
+
+        if args.resize:
+            project.resize(*args.resize)
+
+        if args.optimize:
+            with timer.stage('optimize'):
+                report = optimize(project)
+            print(f'  {report["metatile_slots"]} metatile and {report["metametatile_slots"]} '
+                  f'metametatile slots free ({report["bytes"]} header bytes reclaimable with --resize)')
+
+        if args.convert:
+            with timer.stage('convert'):
+                file_io.write_project(os.path.join(out_dir, f'{name}.{args.convert}'), project)
+
+        if args.bench_io:
+            bench_project_io(project, file_io)
+
+        if args.headers:
+            exporter = HeaderExporter(file_io, args.room_bank, args.room_codec)
+            with timer.stage('headers'):
+                written = exporter.write(out_dir, project)
+            print(f'  headers written: {", ".join(written) if written else "none (unchanged)"}')
+            if exporter.removed:
+                print(f'  headers removed: {", ".join(exporter.removed)}')
+            if args.room_codec != 'none':
+                print(exporter.size_report())
+                rooms = [room.tobytes() for room in project.rooms]
+                print('  all codecs: ' + ', '.join(f'{codec} {size} bytes' for codec, size in compare(rooms).items()))
+
+        renderer = HeadlessRenderer(project, chr_banks)
+        if args.bench_render:
+            bench_render(renderer)
+
+        if args.rooms:
+            with timer.stage('rooms'):
+                indices = parse_rooms(args.rooms, len(project.rooms))
+                for index, arr in zip(indices, renderer.render_rooms(indices)):
+                    save_png(arr, os.path.join(out_dir, f'room_{index}.png'), args.scale)
+
+        if args.metatiles:
+            with timer.stage('metatiles'):
+                save_png(renderer.render_metatile_sheet(), os.path.join(out_dir, 'metatiles.png'), args.scale)
+
+        if args.metametatiles:
+            with timer.stage('metametatiles'):
+                save_png(renderer.render_metametatile_sheet(), os.path.join(out_dir, 'metametatiles.png'), args.scale)
+
+        if chr_banks is not None:
+            print(f'  decoded {chr_banks.decoded()} of {len(chr_banks)} CHR banks')
+    finally:
+        if chr_banks is not None:
+            chr_banks.close()
+
+    print(timer.report(file_path))
+    for stage, seconds in timer.times.items():
+        totals.times[stage] = totals.times.get(stage, 0.0) + seconds
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Export and render chredit projects without a window.')
+    parser.add_argument('projects', nargs='+', help='project files or directories of project files')
+    parser.add_argument('--out', default='build', help='output folder, one subfolder per project')
+    parser.add_argument('--chr', help='CHR file replacing the pattern tables stored in the projects')
+    parser.add_argument('--headers', action='store_true', help='export the C header files')
+    parser.add_argument('--room-bank', type=int, default=0,
+                        help='split rooms into one header per bank of this many rooms')
+    parser.add_argument('--room-codec', choices=list(CODECS), default='none',
+                        help='compress the rooms in rooms.h and report the savings')
+    parser.add_argument('--rooms', nargs='?', const='all', help="render rooms: 'all' or e.g. 0,1,5")
+    parser.add_argument('--metatiles', action='store_true', help='render the metatile sheet')
+    parser.add_argument('--metametatiles', action='store_true', help='render the metametatile sheet')
+    parser.add_argument('--scale', type=int, default=1, help='integer scale of the PNG output')
+    parser.add_argument('--convert', choices=['json', 'chp'], help='save the project in the given format')
+    parser.add_argument('--optimize', action='store_true',
+                        help='merge duplicate metatiles and metametatiles before exporting')
+    parser.add_argument('--resize', type=parse_sizes, metavar='M,N,R',
+                        help='change the number of metatiles, metametatiles and rooms')
+    parser.add_argument('--bench-io', action='store_true', help='time saving and loading in both formats')
+    parser.add_argument('--bench-render', action='store_true',
+                        help='time composing the rooms through the tile cache and the composer')
+    args = parser.parse_args(argv)
+
+    if not (args.headers or args.rooms or args.metatiles or args.metametatiles or args.convert or args.bench_io
+            or args.bench_render):
+        args.headers = args.metatiles = args.metametatiles = True
+        args.rooms = 'all'
+
+    file_io = FileIO()
+    totals = StageTimer()
+    failed = 0
+    projects = find_projects(args.projects)
+    for file_path in projects:
+        try:
+            process(file_path, args, file_io, totals)
+        except (OSError, ValueError, KeyError, IndexError) as e:
+            print(f'Could not process {file_path}: {e}')
+            failed += 1
+
+    if len(projects) > 1:
+        print(totals.report(f'{len(projects)} projects'))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
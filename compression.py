@@ -0,0 +1,137 @@
+"""
+Room compression codecs for the header exporter, with reference decompressors.
+
+rle: a stream of packets. A control byte c < 0x80 is followed by c + 1 literal
+     bytes; c >= 0x80 is followed by one byte that is repeated (c & 0x7f) + 1 times.
+lz:  a stream of packets. A control byte c < 0x80 is followed by c + 1 literal
+     bytes; c >= 0x80 is followed by an offset byte o and copies (c & 0x7f) + 3
+     bytes starting o bytes back in the output (copies may overlap, so o = 1
+     repeats the last byte).
+"""
+from typing import Callable, Dict, Tuple
+
+
+MAX_RUN = 128
+MIN_MATCH = 3
+MAX_MATCH = 0x7f + MIN_MATCH
+MAX_OFFSET = 255
+
+
+def none_encode(data: bytes) -> bytes:
+    return bytes(data)
+
+
+def none_decode(data: bytes) -> bytes:
+    return bytes(data)
+
+
+def _literals(out: bytearray, literals: bytearray) -> None:
+    for start in range(0, len(literals), MAX_RUN):
+        chunk = literals[start:start + MAX_RUN]
+        out.append(len(chunk) - 1)
+        out += chunk
+    literals.clear()
+
+
+def rle_encode(data: bytes) -> bytes:
+    """
+    Encodes runs of two or more equal bytes as run packets, everything else as literals.
+    """
+    out = bytearray()
+    literals = bytearray()
+    i = 0
+    while i < len(data):
+        run = 1
+        while i + run < len(data) and run < MAX_RUN and data[i + run] == data[i]:
+            run += 1
+        if run >= 2:
+            _literals(out, literals)
+            out += bytes((0x80 | (run - 1), data[i]))
+        else:
+            literals.append(data[i])
+        i += run
+    _literals(out, literals)
+    return bytes(out)
+
+
+def rle_decode(data: bytes) -> bytes:
+    out = bytearray()
+    i = 0
+    while i < len(data):
+        control = data[i]
+        if control & 0x80:
+            out += bytes((data[i + 1],)) * ((control & 0x7f) + 1)
+            i += 2
+        else:
+            out += data[i + 1:i + 2 + control]
+            i += 2 + control
+    return bytes(out)
+
+
+def lz_encode(data: bytes) -> bytes:
+    """
+    Greedy LZ77: at each position, uses the longest earlier match of at least
+    MIN_MATCH bytes within MAX_OFFSET, otherwise emits a literal.
+    """
+    out = bytearray()
+    literals = bytearray()
+    i = 0
+    while i < len(data):
+        best_length, best_offset = 0, 0
+        for start in range(max(0, i - MAX_OFFSET), i):
+            length = 0
+            while (i + length < len(data) and length < MAX_MATCH
+                   and data[start + length] == data[i + length]):
+                length += 1
+            if length > best_length:
+                best_length, best_offset = length, i - start
+        if best_length >= MIN_MATCH:
+            _literals(out, literals)
+            out += bytes((0x80 | (best_length - MIN_MATCH), best_offset))
+            i += best_length
+        else:
+            literals.append(data[i])
+            i += 1
+    _literals(out, literals)
+    return bytes(out)
+
+
+def lz_decode(data: bytes) -> bytes:
+    out = bytearray()
+    i = 0
+    while i < len(data):
+        control = data[i]
+        if control & 0x80:
+            start = len(out) - data[i + 1]
+            for j in range((control & 0x7f) + MIN_MATCH):
+                out.append(out[start + j])
+            i += 2
+        else:
+            out += data[i + 1:i + 2 + control]
+            i += 2 + control
+    return bytes(out)
+
+
+CODECS: Dict[str, Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]] = {
+    'none': (none_encode, none_decode),
+    'rle': (rle_encode, rle_decode),
+    'lz': (lz_encode, lz_decode),
+}
+
+
+def compress(data: bytes, codec: str) -> bytes:
+    """
+    Compresses data and checks that the reference decompressor restores it.
+    """
+    encode, decode = CODECS[codec]
+    packed = encode(data)
+    if decode(packed) != bytes(data):
+        raise ValueError(f'{codec} round trip failed')
+    return packed
+
+
+def compare(rooms) -> Dict[str, int]:
+    """
+    Returns the total compressed size of the rooms for every codec.
+    """
+    return {codec: sum(len(CODECS[codec][0](bytes(room))) for room in rooms) for codec in CODECS}
@@ -1,6 +1,11 @@
 WHITE = (255, 255, 255)
+BACKGROUND = (12, 12, 12)
 
 SCALE = 4
+FPS = 60
+AUTOSAVE_INTERVAL = 30
+AUTOSAVE_FILE = 'autosave.chp'
+ROOM_CODEC = 'none'
 SCREEN_WIDTH = 300 * SCALE
 SCREEN_HEIGHT = 200 * SCALE
 MARGIN_TOP = 8
@@ -29,6 +34,22 @@ METATILE_SIZE = 16
 METAMETATILE_SIZE = 32
 ROOM_WIDTH = 128
 ROOM_HEIGHT = 96
+TILE_CACHE_SIZE = 1024
+PAGE_SIZE = 48
+METATILE_COUNT = 48
+METAMETATILE_COUNT = 48
+ROOM_COUNT = 48
+MAX_METATILES = 256
+MAX_METAMETATILES = 256
+MAX_ROOMS = 1024
+MAP_COLUMNS = 8
+MAP_ZOOM_LEVELS = [0.125, 0.25, 0.5, 1, 2]
+MAP_ZOOM = 0.5
+MAP_CACHE_SIZE = 64
+THUMBNAIL_FACTOR = 8
+HISTORY_BYTES = 1 << 20
+HUD_SMOOTHING = 0.1
+DIRTY_RECT_LIMIT = 8
 COLOR_SCALE_HEIGHT = 4
 COLOR_SCALE_WIDTH = 16
 ROOM_WIDTH = 256
@@ -1,23 +1,51 @@
 from __future__ import annotations
-from typing import List, Tuple, Callable
+from typing import Tuple, Callable
 
 import numpy as np
 import pygame
 
+from composer import compose_rooms
 from constants import *
 
 
-def colorize(tile: np.ndarray, palettes: List[str], palette_index: int) -> np.ndarray:
+PALETTE_RGB = np.array(PALETTE_MAP, dtype=np.uint8)
+
+
+def build_palette_lut(palettes: np.ndarray) -> np.ndarray:
+    """
+    Builds an RGB lookup table of shape (palettes, 4, 3) from NES color indices.
+    """
+    return PALETTE_RGB[palettes]
+
+
+def colorize(tiles: np.ndarray, lut: np.ndarray, palette_index) -> np.ndarray:
+    """
+    Colorizes a tile, or a batch of tiles, using a palette lookup table.
+    Tiles are indexed (..., y, x) and the result is laid out (..., x, y, 3)
+    so that it can be handed to pygame.surfarray directly. palette_index may
+    be an int or an array with one entry per tile.
+    """
+    tiles = np.asarray(tiles)
+    palette_index = np.asarray(palette_index)
+    if palette_index.ndim:
+        palette_index = palette_index.reshape(palette_index.shape + (1, 1))
+    return lut[palette_index, np.swapaxes(tiles, -1, -2)]
+
+
+def bank_table(bank: int) -> str:
+    """
+    Returns the name under which the history records edits to a CHR bank.
+    """
+    return {0: 'table_a', 1: 'table_b'}.get(bank, f'bank_{bank}')
+
+
+def clip_cells(cells: np.ndarray, width: int, height: int) -> Tuple[np.ndarray, np.ndarray]:
     """
-    Colorizes a tile using a palette.
+    Splits an (n, 2) array of (x, y) cells into x and y arrays, dropping cells outside the grid.
     """
-    height, width = tile.shape
-    arr = np.zeros((3, height, width))
-    for i in range(height):
-        for j in range(width):
-            color_index = int(palettes[palette_index][tile[i][j]], 16)
-            arr[:, i, j] = PALETTE_MAP[color_index]
-    return arr
+    cells = np.asarray(cells).reshape(-1, 2)
+    inside = (cells[:, 0] >= 0) & (cells[:, 0] < width) & (cells[:, 1] >= 0) & (cells[:, 1] < height)
+    return cells[inside, 0], cells[inside, 1]
 
 
 class TileBase(pygame.sprite.Sprite):
@@ -31,7 +59,11 @@ class TileBase(pygame.sprite.Sprite):
         self.y = y
         self.width = width
         self.height = height
-        self.arr = np.zeros((3, height, width), dtype=int)
+        self.arr = np.zeros((width, height, 3), dtype=np.uint8)
+        self.native = None
+        self.arr_dirty = True
+        self.image_dirty = True
+        self.visible = True
         self.app.ui_renderer.all_sprites.append(self)
 
     def check_click(self, pos: Tuple[int]) -> None:
@@ -46,12 +78,28 @@ class TileBase(pygame.sprite.Sprite):
         """
         pass
 
+    def cell_size(self) -> int:
+        """
+        Returns the on-screen size of one cell of the tile's edit grid.
+        """
+        return self.width * SCALE
+
+    def paint_cells(self, cells: np.ndarray) -> bool:
+        """
+        Applies the current brush to an (n, 2) array of (x, y) cells in one batch.
+        Returns False if the tile cannot be painted in the current mode.
+        """
+        return False
+
     def update_pos(self, x: int, y: int) -> None:
         """
         Updates the position of the tile.
         """
         self.x = x
         self.y = y
+        if hasattr(self, 'rect'):
+            self.rect.x = x
+            self.rect.y = y
 
     def update_arr(self) -> None:
         """
@@ -61,28 +109,46 @@ class TileBase(pygame.sprite.Sprite):
 
     def update_image(self) -> None:
         """
-        Updates the image of the tile.
+        Updates the image of the tile. The native and the scaled surface are kept
+        and redrawn in place; they are only created when the size changes.
         """
-        self.image = pygame.transform.scale(
-            pygame.surfarray.make_surface(self.arr.T),
-            (self.width * SCALE, self.height * SCALE))
-        self.rect = self.image.get_rect()
-        self.rect.x = self.x
-        self.rect.y = self.y
+        if self.native is None or self.native.get_size() != self.arr.shape[:2]:
+            self.native = pygame.Surface(self.arr.shape[:2])
+            self.image = pygame.Surface((self.width * SCALE, self.height * SCALE))
+            self.rect = self.image.get_rect()
+            self.rect.x = self.x
+            self.rect.y = self.y
+        pygame.surfarray.blit_array(self.native, self.arr)
+        pygame.transform.scale(self.native, self.image.get_size(), self.image)
+
+    def refresh_arr(self) -> None:
+        """
+        Updates the array of the tile if it has been invalidated.
+        """
+        if self.arr_dirty:
+            self.update_arr()
+            self.arr_dirty = False
 
     def update(self, *args, **kwargs) -> None:
         """
-        Updates the tile.
+        Updates the tile. Clean tiles keep their cached image.
         """
         super().update()
-        self.update_arr()
-        self.update_image()
+        profiler = self.app.profiler
+        with profiler.phase(f'update_arr {type(self).__name__}'):
+            self.refresh_arr()
+        if self.image_dirty:
+            with profiler.phase('surface'):
+                self.update_image()
+            self.image_dirty = False
+            self.app.presenter.add(self.rect)
 
     def draw(self) -> None:
         """
         Draws the tile.
         """
-        self.app.screen.blit(self.image, self.rect)
+        with self.app.profiler.phase('blit'):
+            self.app.screen.blit(self.image, self.rect)
 
 
 class ColorTile(TileBase):
@@ -93,13 +159,15 @@ class ColorTile(TileBase):
         super().__init__(app, x, y, 4, 4)
         self.app.ui_renderer.tile_sprites.append(self)
         self.index = index
-        self.arr = np.array(PALETTE_MAP[index]).reshape((3, 1, 1))
+        self.arr = PALETTE_RGB[index].reshape((1, 1, 3))
         self.update_image()
 
     def check_click(self, pos: Tuple[int]) -> None:
-        if self.rect.collidepoint(pos):
-            self.app.palettes[self.app.selected_palette][self.app.palette_index] = hex(self.index)
-            self.app.color_scales[self.app.selected_palette].arr = colorize(np.array([[0,1,2,3]]), self.app.palettes, self.app.selected_palette)
+        palette = self.app.project.palettes[self.app.selected_palette]
+        if self.rect.collidepoint(pos) and palette[self.app.palette_index] != self.index:
+            self.app.history.write('palettes', (self.app.selected_palette, self.app.palette_index), self.index)
+            self.app.update_palette_lut()
+            self.app.invalidator.mark_palette(self.app.selected_palette)
 
     def check_mouseover(self, pos: Tuple[int]) -> None:
         if self.rect.collidepoint(pos) and self.app.mode == 'metatiles':
@@ -113,12 +181,12 @@ class ColorTile(TileBase):
 
 class Tiles(TileBase):
     """
-    A class that represents the table of tiles.
+    A class that represents the table of tiles of the selected CHR bank.
     """
     def __init__(self, app: App, x: int, y: int) -> None:
         super().__init__(app, x, y, TILE_SIZE, TILE_SIZE)
         self.app.ui_renderer.tile_sprites.append(self)
-        self.raw_tiles = self.app.table_a
+        self.raw_tiles = self.app.chr_banks.table(self.app.selected_bank)
         self.update_image()
 
     def check_click(self, pos: Tuple[int]) -> None:
@@ -127,13 +195,12 @@ class Tiles(TileBase):
                 x = (pos[0] - self.rect.x) // SCALE
                 y = (pos[1] - self.rect.y) // SCALE
                 if self.app.mode == 'tiles':
-                    self.raw_tiles[y, x] = self.app.palette_index
+                    self.paint_cells(np.array([[x, y]]))
                 elif self.app.mode == 'metatiles':
                     x = x // 8
                     y = y // 8
                     tile_index = y * 16 + x
                     self.app.selected_tile = tile_index
-                self.update_arr()
 
     def check_mouseover(self, pos: Tuple[int]) -> None:
         if self.app.mode in ['tiles', 'metatiles']:
@@ -145,31 +212,68 @@ class Tiles(TileBase):
                 self.app.selection.rect.x = self.rect.x + (x * 8 * SCALE)
                 self.app.selection.rect.y = self.rect.y + (y * 8 * SCALE)
 
+    def cell_size(self) -> int:
+        return SCALE if self.app.mode == 'tiles' else 8 * SCALE
+
+    def paint_cells(self, cells: np.ndarray) -> bool:
+        if self.app.mode != 'tiles':
+            return False
+        xs, ys = clip_cells(cells, TILE_SIZE, TILE_SIZE)
+        changed = self.raw_tiles[ys, xs] != self.app.palette_index
+        if changed.any():
+            bank = self.app.selected_bank
+            self.app.history.write(bank_table(bank), (ys[changed], xs[changed]), self.app.palette_index)
+            self.app.invalidator.mark_tiles(np.unique(ys[changed] // 8 * 16 + xs[changed] // 8), bank)
+        return True
+
     def update_arr(self) -> None:
-        self.arr = colorize(self.raw_tiles, self.app.palettes, self.app.selected_palette)
+        self.arr = colorize(self.raw_tiles, self.app.palette_lut, self.app.selected_palette)
 
 
 class MetaTile(TileBase):
     """
-    A class that represents a metatile.
+    A class that represents a metatile. All four tiles come from the metatile's
+    CHR bank; tiles of another bank can only be placed after moving the metatile
+    to that bank (App.rebank_metatile), as that changes all four quadrants.
     """
     def __init__(self, app: App, x: int, y: int, index: int) -> None:
         super().__init__(app, x, y, METATILE_SIZE, METATILE_SIZE)
-        self.tiles = app.metatiles[index]
-        self.palette = app.metatile_palettes[index]
-        self.index = index
-        self.arr = np.zeros((3, METATILE_SIZE, METATILE_SIZE), dtype=int)
+        self.bank_warned = False
+        self.bind(index)
         self.update_image()
 
+    def bind(self, index: int) -> None:
+        """
+        Points the sprite at another metatile. Slots past the end of the table are hidden.
+        """
+        self.index = index
+        self.bank_warned = False
+        self.visible = index < len(self.app.project.metatiles)
+        if self.visible:
+            self.tiles = self.app.project.metatiles[index]
+            self.palette = self.app.project.metatile_palettes[index]
+        self.arr_dirty = True
+        self.image_dirty = True
+
     def check_click(self, pos: Tuple[int]) -> None:
         if self.app.mode == 'metatiles':
             if self.rect.collidepoint(pos):
                 x = (pos[0] - self.rect.x) // (SCALE * 8)
                 y = (pos[1] - self.rect.y) // (SCALE * 8)
                 metatile_index = y * 2 + x
-                self.tiles[metatile_index] = self.app.selected_tile
-                self.palette = self.app.selected_palette
-                self.app.metatile_palettes[self.index] = self.app.selected_palette
+                bank = self.app.project.metatile_banks[self.index]
+                if bank != self.app.selected_bank:
+                    if not self.bank_warned:
+                        print(f'Metatile {self.index} uses tiles of bank {bank}; '
+                              f'press Ctrl+B to move it to bank {self.app.selected_bank}')
+                        self.bank_warned = True
+                    return
+                if (self.tiles[metatile_index] != self.app.selected_tile
+                        or self.app.project.metatile_palettes[self.index] != self.app.selected_palette):
+                    self.app.history.write('metatiles', (self.index, metatile_index), self.app.selected_tile)
+                    self.app.history.write('metatile_palettes', (self.index,), self.app.selected_palette)
+                    self.palette = self.app.selected_palette
+                    self.app.invalidator.mark_metatiles([self.index])
         if self.app.mode == 'metametatiles':
             if self.rect.collidepoint(pos):
                 self.app.selected_metatile = self.index
@@ -184,16 +288,13 @@ class MetaTile(TileBase):
             self.app.selection.rect.x = self.rect.x + (x * selection_size * SCALE)
             self.app.selection.rect.y = self.rect.y + (y * selection_size * SCALE)
 
+    def cell_size(self) -> int:
+        return 8 * SCALE if self.app.mode == 'metatiles' else 16 * SCALE
+
     def update_arr(self) -> None:
-        self.palette = self.app.metatile_palettes[self.index]
-        for i in range(4):
-            tile = self.tiles[i]
-            table_y = tile // 16
-            table_x = tile % 16
-            arr_x = i % 2 * 8
-            arr_y = i // 2 * 8
-            colorized = colorize(self.app.table_a[table_y*8:table_y*8+8, table_x*8:table_x*8+8], self.app.palettes, self.palette)
-            self.arr[:, arr_y:arr_y+8, arr_x:arr_x+8] = colorized
+        self.palette = self.app.project.metatile_palettes[self.index]
+        self.arr = self.app.tile_cache.compose_metatile(self.tiles, self.palette,
+                                                        self.app.project.metatile_banks[self.index])
 
 
 class MetaMetaTile(TileBase):
@@ -202,20 +303,30 @@ class MetaMetaTile(TileBase):
     """
     def __init__(self, app: App, x: int, y: int, index: int) -> None:
         super().__init__(app, x, y, METAMETATILE_SIZE // 2, METAMETATILE_SIZE // 2)
-        self.metatiles = app.metametatiles[index]
-        self.index = index
-        self.arr = np.zeros((3, METAMETATILE_SIZE, METAMETATILE_SIZE), dtype=int)
+        self.bind(index)
         self.update_image()
 
+    def bind(self, index: int) -> None:
+        """
+        Points the sprite at another metametatile. Slots past the end of the table are hidden.
+        """
+        self.index = index
+        self.visible = index < len(self.app.project.metametatiles)
+        if self.visible:
+            self.metatiles = self.app.project.metametatiles[index]
+        self.arr_dirty = True
+        self.image_dirty = True
+
     def check_click(self, pos: Tuple[int]) -> None:
         if self.rect.collidepoint(pos):
             if self.app.mode == 'metametatiles':
                 x = (pos[0] - self.rect.x) // (SCALE * 8)
                 y = (pos[1] - self.rect.y) // (SCALE * 8)
                 metatile_index = y * 2 + x
-                self.metatiles[metatile_index] = self.app.selected_metatile
-                self.app.metametatiles[self.index] = self.metatiles
-                self.update_image()
+                if self.metatiles[metatile_index] != self.app.selected_metatile:
+                    self.app.history.write('metametatiles', (self.index, metatile_index),
+                                           self.app.selected_metatile)
+                    self.app.invalidator.mark_metametatiles([self.index])
             elif self.app.mode == 'rooms':
                 self.app.selected_metametatile = self.index
 
@@ -229,12 +340,11 @@ class MetaMetaTile(TileBase):
             self.app.selection.rect.x = self.rect.x + (x * selection_size * SCALE)
             self.app.selection.rect.y = self.rect.y + (y * selection_size * SCALE)
 
+    def cell_size(self) -> int:
+        return 8 * SCALE if self.app.mode == 'metametatiles' else 16 * SCALE
+
     def update_arr(self) -> None:
-        for i in range(4):
-            metatile = self.app.ui_renderer.metatile_sprites[self.metatiles[i]]
-            arr_x = i % 2 * 16
-            arr_y = i // 2 * 16
-            self.arr[:, arr_y:arr_y+16, arr_x:arr_x+16] = metatile.arr
+        self.arr = self.app.tile_cache.compose_metametatile(self.metatiles)
 
 
 class Room(TileBase):
@@ -243,17 +353,23 @@ class Room(TileBase):
     """
     def __init__(self, app: App, x: int, y: int, index: int) -> None:
         super().__init__(app, x, y, ROOM_WIDTH // 2, ROOM_HEIGHT // 2)
-        self.metametatiles = app.rooms[index]
-        self.index = index
-        self.arr = np.zeros((3, ROOM_HEIGHT, ROOM_WIDTH), dtype=int)
+        self.bind(index)
         self.update_image()
 
+    def bind(self, index: int) -> None:
+        """
+        Points the sprite at another room.
+        """
+        self.index = index
+        self.metametatiles = self.app.project.rooms[index]
+        self.arr_dirty = True
+        self.image_dirty = True
+
     def check_click(self, pos: Tuple[int]) -> None:
         if self.app.mode == 'rooms' and self.app.active_room == self.index and self.rect.collidepoint(pos):
             x = (pos[0] - self.rect.x) // (SCALE * 16)
             y = (pos[1] - self.rect.y) // (SCALE * 16)
-            self.metametatiles[y][x] = self.app.selected_metametatile
-            self.update_image()
+            self.paint_cells(np.array([[x, y]]))
 
     def check_mouseover(self, pos: Tuple[int]) -> None:
         if self.app.mode == 'rooms' and self.rect.collidepoint(pos):
@@ -264,13 +380,22 @@ class Room(TileBase):
             self.app.selection.rect.x = self.rect.x + (x * 16 * SCALE)
             self.app.selection.rect.y = self.rect.y + (y * 16 * SCALE)
 
+    def cell_size(self) -> int:
+        return 16 * SCALE
+
+    def paint_cells(self, cells: np.ndarray) -> bool:
+        if self.app.mode != 'rooms' or self.app.active_room != self.index:
+            return False
+        xs, ys = clip_cells(cells, 8, 6)
+        changed = self.metametatiles[ys, xs] != self.app.selected_metametatile
+        if changed.any():
+            self.app.history.write('rooms', (self.index, ys[changed], xs[changed]),
+                                   self.app.selected_metametatile)
+            self.app.invalidator.mark_rooms([self.index])
+        return True
+
     def update_arr(self) -> None:
-        for i in range(6):
-            for j in range(8):
-                metatile = self.app.ui_renderer.metametatile_sprites[self.metametatiles[i][j]]
-                arr_x = j * 32
-                arr_y = i * 32
-                self.arr[:, arr_y:arr_y+32, arr_x:arr_x+32] = metatile.arr
+        self.arr = compose_rooms(self.app.project, self.app.palette_lut, self.metametatiles, self.app.chr_banks)
 
 
 class ColorScale(TileBase):
@@ -281,19 +406,24 @@ class ColorScale(TileBase):
         super().__init__(app, x, y, COLOR_SCALE_WIDTH, COLOR_SCALE_HEIGHT)
         self.app.ui_renderer.tile_sprites.append(self)
         self.palette_index = palette_index
-        self.arr = colorize(np.array([[0,1,2,3]]), self.app.palettes, self.palette_index)
+        self.arr = colorize(np.array([[0,1,2,3]]), self.app.palette_lut, self.palette_index)
         self.update_image()
 
     def check_click(self, pos: Tuple[int]) -> None:
         if self.rect.collidepoint(pos):
             x = (pos[0] - self.rect.x) // (SCALE * 4)
+            if self.app.selected_palette != self.palette_index:
+                self.app.invalidator.mark([self.app.tiles])
             self.app.selected_palette = self.palette_index
             self.app.palette_index = x
             self.app.selected_color_x = self.rect.x + (x * 4 * SCALE) - 1
             self.app.selected_color_y = self.rect.y - 1
 
+    def cell_size(self) -> int:
+        return 4 * SCALE
+
     def update_arr(self) -> None:
-        self.arr = colorize(np.array([[0,1,2,3]]), self.app.palettes, self.palette_index)
+        self.arr = colorize(np.array([[0,1,2,3]]), self.app.palette_lut, self.palette_index)
 
     def check_mouseover(self, pos: Tuple[int]) -> None:
         if self.rect.collidepoint(pos) and self.app.mode == 'metatiles':
@@ -343,6 +473,7 @@ class Button(pygame.sprite.Sprite):
         self.rect.x = self.x
         self.rect.y = self.y
         self.on_click = on_click
+        self.hovered = False
         self.app.ui_renderer.all_sprites.append(self)
 
     def draw(self) -> None:
@@ -356,10 +487,11 @@ class Button(pygame.sprite.Sprite):
         """
         Checks if the mouse is over the button.
         """
-        if self.rect.collidepoint(pos):
-            self.background.fill((64, 64, 64))
-        else:
-            self.background.fill((24, 24, 24))
+        hovered = self.rect.collidepoint(pos)
+        if hovered != self.hovered:
+            self.hovered = hovered
+            self.background.fill((64, 64, 64) if hovered else (24, 24, 24))
+            self.app.presenter.add(self.rect)
 
     def check_click(self, pos: Tuple[int]) -> None:
         """
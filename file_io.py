@@ -1,82 +1,205 @@
+import json
+import os
+import struct
+import tempfile
+import time
 import numpy as np
 
+from project import Project
+
+
+TILE_BYTES = 16
+TILES_PER_TABLE = 256
+
+PROJECT_MAGIC = b'CHRP'
+PROJECT_VERSION = 2
+PROJECT_HEADER = struct.Struct('<4sHHHHH2x')
+
+# Read once at import, as os.umask can only be read by setting it, which is not thread-safe.
+UMASK = os.umask(0)
+os.umask(UMASK)
+
 
 class FileIO:
     """
     Class for reading and writing files.
     """
     def __init__(self) -> None:
-        pass
+        self.decode_stats = {'bytes': 0, 'tiles': 0, 'seconds': 0.0, 'mb_per_s': 0.0}
+
+    def decode_tiles(self, raw_data: bytes) -> np.ndarray:
+        """
+        Decode raw CHR data into an (n, 8, 8) uint8 array of color indices.
+        """
+        if len(raw_data) % TILE_BYTES != 0:
+            raise ValueError(f'CHR size {len(raw_data)} is not a multiple of {TILE_BYTES} bytes')
+        planes = np.frombuffer(raw_data, dtype=np.uint8).reshape(-1, 2, 8, 1)
+        bits = np.unpackbits(planes, axis=3)
+        return bits[:, 0] | (bits[:, 1] << 1)
+
+    def tiles_to_table(self, tiles: np.ndarray) -> np.ndarray:
+        """
+        Arrange up to 256 tiles into a 128x128 pattern table (16x16 tiles).
+        """
+        table = np.zeros((TILES_PER_TABLE, 8, 8), dtype=np.uint8)
+        table[:len(tiles)] = tiles[:TILES_PER_TABLE]
+        return table.reshape(16, 16, 8, 8).transpose(0, 2, 1, 3).reshape(128, 128)
 
     def read_file(self, file_path: str) -> np.ndarray:
         """
-        Read a file and return the binary data.
+        Read a file and return the two pattern tables.
         """
         try:
             with open(file_path, 'rb') as file:
                 raw_data = file.read()
 
-            byte_str = ''
-            for byte in raw_data:
-                byte_str += bin(byte)[2:].zfill(8)
-            byte_list = list(byte_str)
-
-            patterns = []
-            for i in range(0, len(byte_list), 128):
-                map1 = []
-                for j in range(0, 64, 8):
-                    row = byte_list[i+j:i+j+8]
-                    map1.append(row)
-
-                map2 = []
-                for j in range(64, 128, 8):
-                    row = byte_list[i+j:i+j+8]
-                    map2.append(row)
-
-                map3 = np.char.add(map1, map2)
-                color_map = {'00': 0, '10': 1, '01': 2, '11': 3}
-                map3 = np.vectorize(color_map.get)(map3)
-
-                patterns.append(map3)
-
-            table_a = patterns[:256]
-            table_a_display = np.zeros((128, 128), dtype=int)
-
-            table_b = patterns[256:]
-            table_b_display = np.zeros((128, 128), dtype=int)
-
-            cur_idx = 0
+            start = time.perf_counter()
+            tiles = self.decode_tiles(raw_data)
+            table_a = self.tiles_to_table(tiles[:TILES_PER_TABLE])
+            table_b = self.tiles_to_table(tiles[TILES_PER_TABLE:2 * TILES_PER_TABLE])
+            elapsed = time.perf_counter() - start
 
-            for i in range(0, 128, 8):
-                for j in range(0, 128, 8):
-                    table_a_display[i:i+8, j:j+8] = table_a[cur_idx]
-                    table_b_display[i:i+8, j:j+8] = table_b[cur_idx]
-                    cur_idx += 1
+            mb_per_s = len(raw_data) / (1024 * 1024) / elapsed if elapsed > 0 else float('inf')
+            self.decode_stats = {'bytes': len(raw_data), 'tiles': len(tiles),
+                                 'seconds': elapsed, 'mb_per_s': mb_per_s}
+            print(f'Decoded {len(tiles)} tiles ({len(raw_data) / 1024:.1f} KB) '
+                  f'in {elapsed * 1000:.2f} ms ({mb_per_s:.1f} MB/s)')
 
-            return table_a_display, table_b_display
+            return table_a, table_b
         except Exception as e:
             print(f'Error reading file: {e}')
-            return np.zeros((128, 128), dtype=int), np.zeros((128, 128), dtype=int)
+            return np.zeros((128, 128), dtype=np.uint8), np.zeros((128, 128), dtype=np.uint8)
 
-    def to_binary(self, x: np.ndarray) -> str:
+    def encode_tiles(self, tiles: np.ndarray) -> bytes:
         """
-        Convert a numpy array to CHR binary.
+        Encode an (n, 8, 8) array of color indices into raw CHR data.
         """
-        bin_data = []
+        tiles = np.asarray(tiles, dtype=np.uint8)
+        planes = np.stack((tiles & 1, (tiles >> 1) & 1), axis=1)
+        return np.packbits(planes, axis=3).tobytes()
 
-        for i in range(0, 128, 8):
-            for j in range(0, 128, 8):
-                block = x[i:i+8, j:j+8]
-                bin_data.append(block)
+    def table_to_tiles(self, table: np.ndarray) -> np.ndarray:
+        """
+        Split a 128x128 pattern table into 256 tiles, inverse of tiles_to_table.
+        """
+        return np.asarray(table).reshape(16, 8, 16, 8).transpose(0, 2, 1, 3).reshape(TILES_PER_TABLE, 8, 8)
 
-        inverse_color_map = {0: '00', 1: '10', 2: '01', 3: '11'}
-        bin_data = np.vectorize(inverse_color_map.get)(bin_data)
+    def to_binary(self, x: np.ndarray) -> bytes:
+        """
+        Convert a pattern table to CHR binary (4 KB, NES bitplane order).
+        """
+        return self.encode_tiles(self.table_to_tiles(x))
 
-        map1 = np.vectorize(lambda x: x[:1])(bin_data)
-        map2 = np.vectorize(lambda x: x[1:])(bin_data)
+    def write_file(self, file_path: str, table_a: np.ndarray, table_b: np.ndarray) -> None:
+        """
+        Write both pattern tables to an 8 KB CHR file.
+        Reading the file back with read_file yields the same tables.
+        """
+        data = bytearray(self.to_binary(table_a))
+        data += self.to_binary(table_b)
+        with open(file_path, 'wb') as file:
+            file.write(data)
 
-        res = ''
-        for i in range(256):
-            res += ''.join(map1[i].flatten()) + ''.join(map2[i].flatten())
+    def read_project(self, file_path: str) -> Project:
+        """
+        Read a project file, either JSON or binary (see read_project_binary).
+        """
+        with open(file_path, 'rb') as file:
+            magic = file.read(len(PROJECT_MAGIC))
+        if magic == PROJECT_MAGIC:
+            project = self.read_project_binary(file_path)
+        else:
+            with open(file_path, 'r', encoding='utf-8') as file:
+                serialized = json.load(file)
+            project = Project(
+                [[int(color, 16) for color in palette] for palette in serialized['palettes']],
+                serialized['table_a'], serialized['table_b'], serialized['metatiles'],
+                serialized['metatile_palettes'], serialized['metametatiles'], serialized['rooms'],
+                serialized.get('metatile_banks'))
+        project.check_sizes()
+        return project
+
+    def read_project_binary(self, file_path: str) -> Project:
+        """
+        Read a binary project file with a single buffer read. The arrays of the
+        project are views into that buffer.
+
+        Layout (little endian): magic 'CHRP', u16 version, u16 palette count,
+        u16 metatile count, u16 metametatile count, u16 room count, 2 bytes padding,
+        followed by uint8 arrays: palettes (P x 4 color indices), table_a and table_b
+        (128 x 128 each), metatiles (M x 4), metatile palettes (M),
+        metametatiles (N x 4) and rooms (R x 6 x 8). Version 2 adds the metatile
+        banks (M) at the end; version 1 files load with every metatile in bank 0.
+        """
+        with open(file_path, 'rb') as file:
+            buffer = bytearray(os.fstat(file.fileno()).st_size)
+            file.readinto(buffer)
+
+        magic, version, n_palettes, n_metatiles, n_metametatiles, n_rooms = PROJECT_HEADER.unpack_from(buffer)
+        if magic != PROJECT_MAGIC:
+            raise ValueError('Not a binary project file')
+        if version > PROJECT_VERSION:
+            raise ValueError(f'Unsupported project version {version}')
+
+        offset = PROJECT_HEADER.size
+        sections = []
+        shapes = [(n_palettes, 4), (128, 128), (128, 128), (n_metatiles, 4), (n_metatiles,),
+                  (n_metametatiles, 4), (n_rooms, 6, 8)]
+        if version >= 2:
+            shapes.append((n_metatiles,))
+        for shape in shapes:
+            count = int(np.prod(shape))
+            sections.append(np.frombuffer(buffer, dtype=np.uint8, count=count, offset=offset).reshape(shape))
+            offset += count
+        return Project(*sections)
+
+    def serialize_project(self, project: Project, binary: bool = False) -> bytes:
+        """
+        Serialize a project to JSON or, if binary is set, to the format described in read_project_binary.
+        """
+        if binary:
+            header = PROJECT_HEADER.pack(PROJECT_MAGIC, PROJECT_VERSION, len(project.palettes),
+                                         len(project.metatiles), len(project.metametatiles), len(project.rooms))
+            sections = [project.palettes, project.table_a, project.table_b, project.metatiles,
+                        project.metatile_palettes, project.metametatiles, project.rooms, project.metatile_banks]
+            return header + b''.join(section.tobytes() for section in sections)
+
+        serialized = {
+            'palettes': project.hex_palettes(),
+            'table_a': project.table_a.tolist(),
+            'table_b': project.table_b.tolist(),
+            'metatiles': project.metatiles.tolist(),
+            'metatile_palettes': project.metatile_palettes.tolist(),
+            'metametatiles': project.metametatiles.tolist(),
+            'rooms': project.rooms.tolist(),
+            'metatile_banks': project.metatile_banks.tolist()
+        }
+        return json.dumps(serialized).encode('utf-8')
+
+    def write_project(self, file_path: str, project: Project) -> None:
+        """
+        Write a project to file. Files ending in .chp use the binary format, anything else JSON.
+        """
+        self.write_atomic(file_path, self.serialize_project(project, binary=file_path.endswith('.chp')))
 
-        return res
+    def write_atomic(self, file_path: str, data: bytes) -> None:
+        """
+        Write data to a temporary file next to file_path and rename it into place,
+        so that a crash never leaves a partially written file behind. The file keeps
+        its permissions, and a new file gets the default ones (mkstemp creates the
+        temporary file readable by the owner only).
+        """
+        folder = os.path.dirname(os.path.abspath(file_path))
+        fd, temp_path = tempfile.mkstemp(dir=folder, prefix='.', suffix='.tmp')
+        try:
+            mode = os.stat(file_path).st_mode if os.path.exists(file_path) else 0o666 & ~UMASK
+            os.chmod(temp_path, mode & 0o777)
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, file_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
@@ -0,0 +1,134 @@
+from __future__ import annotations
+import hashlib
+import os
+import re
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+from compression import CODECS, compress
+from file_io import FileIO
+from project import Project
+
+
+NUMBER_STRINGS = np.array([f'{i}, ' for i in range(256)], dtype=object)
+OWNED_HEADERS = re.compile(r'(metatiles|metametatiles|metatile_banks|palettes|rooms(_\d+)?)\.h')
+
+
+def format_rows(rows: Iterable) -> str:
+    """
+    Formats rows of byte values as tab-indented lines of comma-terminated numbers.
+    """
+    cells = NUMBER_STRINGS[np.asarray(rows, dtype=np.uint8)]
+    return ''.join('\t' + ''.join(row) + '\n' for row in cells)
+
+
+class HeaderExporter:
+    """
+    Builds the C headers of a project in memory and writes only the files whose
+    content differs from what is already on disk, so unchanged headers keep their
+    mtime and are not rebuilt. With room_bank_size set, rooms are split into one
+    header per bank (rooms_0.h, rooms_1.h, ...) that rooms.h includes. Rooms can
+    be compressed with one of the codecs in compression.CODECS. The CHR bank of
+    every metatile is only exported (metatile_banks.h) if some metatile uses a
+    bank other than 0.
+    """
+    def __init__(self, file_io: FileIO, room_bank_size: int = 0, room_codec: str = 'none') -> None:
+        if room_codec not in CODECS:
+            raise ValueError(f'Unknown room codec {room_codec}')
+        self.file_io = file_io
+        self.room_bank_size = room_bank_size
+        self.room_codec = room_codec
+        self.room_sizes = []
+        self.removed = []
+
+    def build(self, project: Project) -> Dict[str, str]:
+        """
+        Returns the content of every header, keyed by file name.
+        """
+        metatiles = np.column_stack((project.metatiles, project.metatile_palettes))
+        headers = {
+            'metatiles.h': 'const unsigned char metatiles[] = {\n' + format_rows(metatiles) + '};\n\n',
+            'metametatiles.h': 'const unsigned char metametatiles[] = {\n' + format_rows(project.metametatiles) + '};\n\n',
+            'palettes.h': 'const unsigned char palette_bg[] = {\n'
+                          + ''.join('\t' + ''.join(f'{color}, ' for color in palette) + '\n'
+                                    for palette in project.hex_palettes())
+                          + '};\n\n',
+        }
+        if project.metatile_banks.any():
+            headers['metatile_banks.h'] = ('const unsigned char metatile_banks[] = {\n'
+                                           + format_rows(project.metatile_banks.reshape(-1, 1)) + '};\n\n')
+
+        self.room_sizes = []
+        rooms = [self.format_room(i, room) for i, room in enumerate(project.rooms)]
+        if self.room_bank_size:
+            includes = []
+            for bank, start in enumerate(range(0, len(rooms), self.room_bank_size)):
+                name = f'rooms_{bank}.h'
+                headers[name] = ''.join(rooms[start:start + self.room_bank_size])
+                includes.append(f'#include "{name}"\n')
+            headers['rooms.h'] = ''.join(includes)
+        else:
+            headers['rooms.h'] = ''.join(rooms)
+        return headers
+
+    def format_room(self, index: int, room: np.ndarray) -> str:
+        """
+        Formats one room as a C array, compressed with the room codec.
+        """
+        if self.room_codec == 'none':
+            self.room_sizes.append((room.size, room.size))
+            return f'const unsigned char room_{index}[] = ' + '{\n' + format_rows(room) + '};\n\n'
+
+        packed = np.frombuffer(compress(room.tobytes(), self.room_codec), dtype=np.uint8)
+        self.room_sizes.append((room.size, packed.size))
+        lines = format_rows(packed[:packed.size // 8 * 8].reshape(-1, 8))
+        if packed.size % 8:
+            lines += format_rows(packed[packed.size // 8 * 8:].reshape(1, -1))
+        return (f'// {self.room_codec}: {packed.size} bytes ({room.size} raw)\n'
+                f'const unsigned char room_{index}[] = ' + '{\n' + lines + '};\n\n')
+
+    def size_report(self) -> str:
+        """
+        Describes the per-room and total savings of the last build.
+        """
+        lines = []
+        for i, (raw, packed) in enumerate(self.room_sizes):
+            lines.append(f'room_{i}: {raw} -> {packed} bytes ({1 - packed / raw:.0%} saved)')
+        raw = sum(size[0] for size in self.room_sizes)
+        packed = sum(size[1] for size in self.room_sizes)
+        if raw:
+            lines.append(f'{self.room_codec}: {raw} -> {packed} bytes in total ({1 - packed / raw:.0%} saved)')
+        return '\n'.join(lines)
+
+    def write(self, destination_folder: str, project: Project) -> List[str]:
+        """
+        Writes the headers that changed and returns their file names. Headers this
+        exporter writes that are no longer part of the output, like rooms_<n>.h
+        after the number of banks shrank, are deleted and listed in removed.
+        """
+        written = []
+        headers = self.build(project)
+        for name, content in headers.items():
+            data = content.encode('utf-8')
+            file_path = os.path.join(destination_folder, name)
+            if self.digest_on_disk(file_path) == hashlib.sha1(data).digest():
+                continue
+            self.file_io.write_atomic(file_path, data)
+            written.append(name)
+        self.removed = []
+        for name in sorted(os.listdir(destination_folder)):
+            if OWNED_HEADERS.fullmatch(name) and name not in headers:
+                os.remove(os.path.join(destination_folder, name))
+                self.removed.append(name)
+        return written
+
+    def digest_on_disk(self, file_path: str) -> bytes:
+        """
+        Returns the SHA-1 digest of an existing file, or an empty digest if there is none.
+        """
+        try:
+            with open(file_path, 'rb') as file:
+                return hashlib.sha1(file.read()).digest()
+        except FileNotFoundError:
+            return b''
@@ -0,0 +1,185 @@
+from __future__ import annotations
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from constants import *
+from project import Project
+
+
+EDITABLE_TABLES = ['palettes', 'table_a', 'table_b', 'metatiles', 'metatile_palettes', 'metatile_banks',
+                   'metametatiles', 'rooms']
+
+
+class Stroke:
+    """
+    The changes of one undo step: for each project table, the flat indices of the
+    changed entries with their values before and after the step.
+    """
+    __slots__ = ('deltas',)
+
+    def __init__(self, deltas: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]]) -> None:
+        self.deltas = deltas
+
+    def nbytes(self) -> int:
+        return sum(array.nbytes for delta in self.deltas.values() for array in delta)
+
+
+class History:
+    """
+    Undo/redo journal of edits to the project. Edits are written through write(),
+    which records the flat index, old and new value of every changed entry instead
+    of a snapshot of the table. Everything written between begin_stroke() and
+    end_stroke() (one mouse drag) is one undo step, with repeated writes to the same
+    entry folded into one delta. The oldest steps are dropped once the journal
+    holds more than max_bytes.
+    """
+    def __init__(self, app: App, max_bytes: int = HISTORY_BYTES) -> None:
+        self.app = app
+        self.max_bytes = max_bytes
+        self.undo_stack: List[Stroke] = []
+        self.redo_stack: List[Stroke] = []
+        self.pending: Optional[Dict[str, List[Tuple[np.ndarray, np.ndarray]]]] = None
+        self.nbytes = 0
+
+    def begin_stroke(self) -> None:
+        """
+        Starts collecting writes into one undo step.
+        """
+        self.end_stroke()
+        self.pending = {}
+
+    def end_stroke(self) -> None:
+        """
+        Closes the current undo step. Steps without any change are dropped.
+        """
+        pending, self.pending = self.pending, None
+        if not pending:
+            return
+        deltas = {}
+        for table, writes in pending.items():
+            indices = np.concatenate([indices for indices, _ in writes])
+            old = np.concatenate([old for _, old in writes])
+            indices, first = np.unique(indices, return_index=True)
+            old = old[first]
+            new = self.array(table).reshape(-1)[indices]
+            changed = old != new
+            if changed.any():
+                deltas[table] = (indices[changed].astype(np.uint32), old[changed], new[changed])
+        if deltas:
+            self.push(Stroke(deltas))
+
+    def write(self, table: str, index, value) -> None:
+        """
+        Assigns value to the entries of a project table at index (a tuple of index
+        arrays, as for numpy indexing) and records the change.
+        """
+        arr = self.array(table)
+        indices = np.unique(np.ravel_multi_index(tuple(np.atleast_1d(i) for i in index), arr.shape))
+        flat = arr.reshape(-1)
+        old = flat[indices]
+        flat[indices] = value
+        if self.pending is None:
+            self.begin_stroke()
+            self.pending.setdefault(table, []).append((indices, old))
+            self.end_stroke()
+        else:
+            self.pending.setdefault(table, []).append((indices, old))
+
+    def array(self, table: str) -> np.ndarray:
+        """
+        Returns a table of the project, or the pattern table of CHR bank N for 'bank_N'.
+        """
+        if table.startswith('bank_'):
+            return self.app.chr_banks.table(int(table[5:]))
+        return getattr(self.app.project, table)
+
+    def record_changes(self, before: Project) -> None:
+        """
+        Records every difference between a copy of the project and the project as
+        one undo step, e.g. after an operation that rewrites whole tables.
+        """
+        self.end_stroke()
+        deltas = {}
+        for table in EDITABLE_TABLES:
+            old = getattr(before, table).reshape(-1)
+            new = getattr(self.app.project, table).reshape(-1)
+            if old.shape != new.shape:
+                self.clear()
+                return
+            indices = np.flatnonzero(old != new)
+            if len(indices):
+                deltas[table] = (indices.astype(np.uint32), old[indices], new[indices])
+        if deltas:
+            self.push(Stroke(deltas))
+
+    def push(self, stroke: Stroke) -> None:
+        """
+        Adds an undo step, discards the redo steps and enforces the memory cap.
+        """
+        self.undo_stack.append(stroke)
+        self.nbytes += stroke.nbytes()
+        for redo in self.redo_stack:
+            self.nbytes -= redo.nbytes()
+        self.redo_stack.clear()
+        while self.nbytes > self.max_bytes and len(self.undo_stack) > 1:
+            self.nbytes -= self.undo_stack.pop(0).nbytes()
+
+    def undo(self) -> bool:
+        """
+        Reverts the last undo step. Returns False if there is nothing to undo.
+        """
+        self.end_stroke()
+        if not self.undo_stack:
+            return False
+        stroke = self.undo_stack.pop()
+        self.apply(stroke, 1)
+        self.redo_stack.append(stroke)
+        return True
+
+    def redo(self) -> bool:
+        """
+        Repeats the last undone step. Returns False if there is nothing to redo.
+        """
+        self.end_stroke()
+        if not self.redo_stack:
+            return False
+        stroke = self.redo_stack.pop()
+        self.apply(stroke, 2)
+        self.undo_stack.append(stroke)
+        return True
+
+    def apply(self, stroke: Stroke, column: int) -> None:
+        """
+        Writes the old (column 1) or new (column 2) values of a step and marks only
+        the entries it touched.
+        """
+        for table, delta in stroke.deltas.items():
+            self.array(table).reshape(-1)[delta[0]] = delta[column]
+        invalidator = self.app.invalidator
+        for table, (indices, _, _) in stroke.deltas.items():
+            indices = indices.astype(np.intp)
+            if table == 'palettes':
+                self.app.update_palette_lut()
+                for palette in np.unique(indices // 4):
+                    invalidator.mark_palette(int(palette))
+            elif table in ['table_a', 'table_b'] or table.startswith('bank_'):
+                bank = {'table_a': 0, 'table_b': 1}[table] if table.startswith('table') else int(table[5:])
+                invalidator.mark_tiles(np.unique(indices // 1024 * 16 + indices % 128 // 8), bank)
+            elif table == 'metatiles':
+                invalidator.mark_metatiles(np.unique(indices // 4))
+            elif table in ['metatile_palettes', 'metatile_banks']:
+                invalidator.mark_metatiles(np.unique(indices))
+            elif table == 'metametatiles':
+                invalidator.mark_metametatiles(np.unique(indices // 4))
+            elif table == 'rooms':
+                invalidator.mark_rooms(np.unique(indices // 48))
+
+    def clear(self) -> None:
+        """
+        Forgets all steps, e.g. after the tables were replaced by loading a file.
+        """
+        self.pending = None
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self.nbytes = 0
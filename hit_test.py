@@ -0,0 +1,63 @@
+from __future__ import annotations
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from constants import *
+
+
+def line_cells(start: Tuple[int, int], end: Tuple[int, int]) -> np.ndarray:
+    """
+    Returns the (n, 2) array of grid cells on the line from start to end, both included.
+    """
+    steps = max(abs(end[0] - start[0]), abs(end[1] - start[1]))
+    t = np.linspace(0.0, 1.0, steps + 1)
+    xs = np.rint(start[0] + (end[0] - start[0]) * t).astype(int)
+    ys = np.rint(start[1] + (end[1] - start[1]) * t).astype(int)
+    return np.stack((xs, ys), axis=1)
+
+
+class SpatialIndex:
+    """
+    Grid of screen buckets mapping a mouse position to the sprite under it.
+    One grid is kept per mode and only holds the sprites active in that mode.
+    """
+    def __init__(self, app: App, bucket_size: int = 16 * SCALE) -> None:
+        self.app = app
+        self.bucket_size = bucket_size
+        self.grids: Dict[str, Dict[Tuple[int, int], List]] = {}
+
+    def rebuild(self) -> None:
+        """
+        Rebuilds the grid of the current mode. Called whenever sprites move.
+        """
+        grid = {}
+        size = self.bucket_size
+        for sprite in self.app.ui_renderer.interactive_sprites():
+            rect = sprite.rect
+            for bx in range(rect.left // size, (rect.right - 1) // size + 1):
+                for by in range(rect.top // size, (rect.bottom - 1) // size + 1):
+                    grid.setdefault((bx, by), []).append(sprite)
+        self.grids[self.app.mode] = grid
+
+    def sprite_at(self, pos: Tuple[int]) -> Optional[object]:
+        """
+        Returns the active sprite under the position, if any.
+        """
+        if self.app.mode not in self.grids:
+            self.rebuild()
+        bucket = self.grids[self.app.mode].get((pos[0] // self.bucket_size, pos[1] // self.bucket_size), ())
+        for sprite in bucket:
+            if sprite.rect.collidepoint(pos):
+                return sprite
+        return None
+
+    def lookup(self, pos: Tuple[int]) -> Tuple[Optional[object], Optional[Tuple[int, int]]]:
+        """
+        Returns the sprite under the position and the (x, y) cell of its edit grid.
+        """
+        sprite = self.sprite_at(pos)
+        if sprite is None or not hasattr(sprite, 'cell_size'):
+            return sprite, None
+        cell_size = sprite.cell_size()
+        return sprite, ((pos[0] - sprite.rect.x) // cell_size, (pos[1] - sprite.rect.y) // cell_size)
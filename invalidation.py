@@ -0,0 +1,107 @@
+from __future__ import annotations
+from typing import Iterable
+
+import numpy as np
+
+
+class Invalidator:
+    """
+    Tracks which sprites need to be re-rendered. Edits are propagated along the
+    dependency chain tile -> metatile -> metametatile -> room, and palette
+    changes reach every sprite drawn with that palette. Every change to the
+    project data also bumps revision, which tells autosave whether there is
+    anything new to write.
+    """
+    def __init__(self, app: App) -> None:
+        self.app = app
+        self.revision = 0
+
+    def mark(self, sprites: Iterable) -> None:
+        """
+        Marks the given sprites as dirty.
+        """
+        self.app.needs_redraw = True
+        for sprite in sprites:
+            sprite.arr_dirty = True
+            sprite.image_dirty = True
+
+    def mark_visible(self, table: str, indices: Iterable[int]) -> None:
+        """
+        Marks the sprites of the entries that are on the current page of a panel.
+        Entries on other pages are rendered when their page is bound.
+        """
+        sprites = (self.app.ui_renderer.sprite_for(table, i) for i in indices)
+        self.mark(sprite for sprite in sprites if sprite is not None)
+
+    def mark_all(self) -> None:
+        """
+        Marks every sprite as dirty, e.g. after loading a project or CHR file.
+        """
+        self.revision += 1
+        self.app.tile_cache.clear()
+        self.app.world_map.clear()
+        self.app.room_overview.clear()
+        self.mark(sprite for sprite in self.app.ui_renderer.all_sprites if hasattr(sprite, 'arr_dirty'))
+
+    def mark_tiles(self, tile_indices: Iterable[int], bank: int = 0) -> None:
+        """
+        Marks the pattern table and every metatile using one of the tiles of the CHR bank.
+        """
+        tile_indices = list(tile_indices)
+        if not tile_indices:
+            return
+        self.revision += 1
+        self.app.tile_cache.invalidate_tiles(bank, tile_indices)
+        if bank == self.app.selected_bank:
+            self.mark([self.app.tiles])
+        project = self.app.project
+        uses = np.isin(project.metatiles, tile_indices).any(axis=1) & (project.metatile_banks == bank)
+        self.mark_metatiles(np.flatnonzero(uses))
+
+    def mark_metatiles(self, indices: Iterable[int]) -> None:
+        """
+        Marks metatiles and every metametatile built from them.
+        """
+        indices = list(indices)
+        if not indices:
+            return
+        self.revision += 1
+        self.mark_visible('metatiles', indices)
+        uses = np.isin(self.app.project.metametatiles, indices).any(axis=1)
+        self.mark_metametatiles(np.flatnonzero(uses))
+
+    def mark_metametatiles(self, indices: Iterable[int]) -> None:
+        """
+        Marks metametatiles and every room containing them.
+        """
+        indices = list(indices)
+        if not indices:
+            return
+        self.revision += 1
+        self.mark_visible('metametatiles', indices)
+        self.app.world_map.invalidate_metametatiles(indices)
+        uses = np.isin(self.app.project.rooms, indices).any(axis=(1, 2))
+        self.mark_rooms(np.flatnonzero(uses))
+
+    def mark_rooms(self, indices: Iterable[int]) -> None:
+        """
+        Marks rooms.
+        """
+        indices = list(indices)
+        self.revision += 1
+        self.app.world_map.invalidate(indices)
+        self.app.room_overview.invalidate(indices)
+        if self.app.active_room in indices:
+            self.mark([self.app.ui_renderer.room_sprite])
+
+    def mark_palette(self, palette_index: int) -> None:
+        """
+        Marks everything drawn with the given palette.
+        """
+        self.revision += 1
+        self.app.tile_cache.invalidate_palette(palette_index)
+        self.mark([self.app.color_scales[palette_index]])
+        if palette_index == self.app.selected_palette:
+            self.mark([self.app.tiles])
+        uses = self.app.project.metatile_palettes == palette_index
+        self.mark_metatiles(np.flatnonzero(uses))
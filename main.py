@@ -1,15 +1,31 @@
+import argparse
+import cProfile
 import json
 import os
-import numpy as np
+import time
 import pygame
 import tkinter as tk
 
+from typing import Tuple
 from tkinter import filedialog
 from pygame.locals import HWSURFACE, DOUBLEBUF, RESIZABLE
 
-from entities import Selection, Room, MetaTile, MetaMetaTile, ColorScale, Tiles, ColorTile, Button
+from autosave import AutoSaver
+from chr_banks import ChrBanks
+from entities import Selection, Room, MetaTile, MetaMetaTile, ColorScale, Tiles, ColorTile, Button, build_palette_lut
 from file_io import FileIO
-from ui_renderer import UIRenderer
+from header_export import HeaderExporter
+from history import History
+from hit_test import SpatialIndex, line_cells
+from invalidation import Invalidator
+from optimizer import optimize
+from presenter import Presenter
+from profiler import FrameProfiler
+from project import Project
+from room_overview import RoomOverview
+from tile_cache import TileCache
+from ui_renderer import UIRenderer, PAGED_PANELS
+from world_map import WorldMap
 from constants import *
 
 
@@ -17,25 +33,41 @@ class App:
     """
     Main application class. Handles the main loop and event handling.
     """
-    def __init__(self) -> None:
-        self.table_a = np.zeros((128, 128), dtype=int)
-        self.table_b = np.zeros((128, 128), dtype=int)
+    def __init__(self, hud: bool = False, map_columns: int = MAP_COLUMNS) -> None:
+        self.project = Project.empty()
         self.file_io = FileIO()
+        self.header_exporter = HeaderExporter(self.file_io, room_codec=ROOM_CODEC)
         self.ui_renderer = UIRenderer(self)
+        self.invalidator = Invalidator(self)
+        self.history = History(self)
+        self.tile_cache = TileCache(self)
+        self.hit_index = SpatialIndex(self)
+        self.hovered = None
+        self.drag_from = None
+        self.press_consumed = False
         self.current_dir = os.path.dirname(os.path.realpath(__file__))
+        self.project_path = None
+
+        self.presenter = Presenter(self)
 
         pygame.init()
 
-        self.screen = pygame.display.set_mode(
+        self.window = pygame.display.set_mode(
             (SCREEN_WIDTH, SCREEN_HEIGHT), HWSURFACE | DOUBLEBUF | RESIZABLE)
+        self.canvas = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT)).convert()
+        self.update_viewport()
         self.running = False
-
-        self.palettes = [
-            ['0x0f', '0x01', '0x11', '0x21'],
-            ['0x0f', '0x05', '0x15', '0x25'],
-            ['0x0f', '0x08', '0x18', '0x28'],
-            ['0x0f', '0x0a', '0x1a', '0x2a']
-        ]
+        self.needs_redraw = True
+        self.clock = pygame.time.Clock()
+        self.fps_cap = FPS
+        self.fps = 0.0
+        self.frames_drawn = 0
+        self.frame_cpu_time = 0.0
+        self.cpu_time = 0.0
+
+        self.update_palette_lut()
+        self.chr_banks = ChrBanks.from_tables(self.file_io, self.project.table_a, self.project.table_b)
+        self.selected_bank = 0
 
         self.selected_palette = 0
         self.palette_index = 0
@@ -52,20 +84,21 @@ class App:
         self.mode = 'metatiles'
 
         self.font = pygame.font.Font(None, 8 * SCALE)
+        self.profiler = FrameProfiler(self, hud)
 
         self.text_left = self.font.render('Tiles', True, WHITE)
         self.text_right = self.font.render('Metatiles', True, WHITE)
         self.palette_text = self.font.render('Palettes', True, WHITE)
 
-        self.metatiles = [[0, 0, 0, 0] for i in range(48)]
-        self.metatile_palettes = [0] * 48
-        self.metametatiles = [[0, 0, 0, 0] for i in range(48)]
-        self.rooms = [np.zeros((6, 8), dtype=int) for i in range(48)]
+        self.pages = {'metatiles': 0, 'metametatiles': 0}
+        self.map_columns = map_columns
 
         self.initialize_panels()
         self.initialize_buttons()
         self.initialize_colors()
 
+        self.autosaver = AutoSaver(self)
+
     def initialize_buttons(self) -> None:
         """
         Initializes the buttons in the UI.
@@ -73,42 +106,62 @@ class App:
         button_height = 8
         button_x = MARGIN_LEFT
 
-        button_labels = ['CHR', 'Load', 'Save', 'Export',
-                         'Metatiles', 'Metametatiles', 'Rooms', 'Exit']
-        button_functions = [self.open_chr_file, self.import_data, self.export, self.write_to_file,
+        button_labels = ['CHR', 'Save CHR', 'Load', 'Save', 'Export', 'Optimize', 'Tiles',
+                         'Metatiles', 'Metametatiles', 'Rooms', 'Map', 'Exit']
+        button_functions = [self.open_chr_file, self.save_chr_file, self.import_data, self.export,
+                            self.write_to_file, self.optimize_tables, self.switch_mode_tiles,
                             self.switch_mode_metatiles, self.switch_mode_metametatiles,
-                            self.switch_mode_rooms, self.quit]
+                            self.switch_mode_rooms, self.switch_mode_map, self.quit]
 
         for i, label in enumerate(button_labels):
-            button_width = 24 if len(label) <= 6 else 48
+            button_width = self.font.size(label)[0] + 4 * SCALE
             self.ui_renderer.menu_buttons.append(Button(
-                self, button_x, MARGIN_TOP, button_width * SCALE, button_height * SCALE, label,
+                self, button_x, MARGIN_TOP, button_width, button_height * SCALE, label,
                 button_functions[i]))
-            button_x += button_width * SCALE + SPACING
+            button_x += button_width + SPACING
 
         self.ui_renderer.arrow_buttons = [
             Button(self, 16 + 128 * SCALE, (32 * SCALE) + 8 + 96 * SCALE,
                    8 * SCALE, 8 * SCALE, '<', self.decrease_room),
             Button(self, 32 + (8 * SCALE) + 128 * SCALE, (32 * SCALE) +
-                   8 + 96 * SCALE, 8 * SCALE, 8 * SCALE, '>', self.increase_room)
+                   8 + 96 * SCALE, 8 * SCALE, 8 * SCALE, '>', self.increase_room),
+            Button(self, 48 + (16 * SCALE) + 128 * SCALE, (32 * SCALE) + 8 + 96 * SCALE,
+                   self.font.size('All')[0] + 4 * SCALE, 8 * SCALE, 'All', self.switch_mode_overview)
         ]
 
+        bank_x = MARGIN_LEFT + 128 * SCALE - 16 * SCALE - 16
+        self.ui_renderer.bank_buttons = [
+            Button(self, bank_x, MENU_HEIGHT, 8 * SCALE, 8 * SCALE, '<', lambda: self.turn_bank(-1)),
+            Button(self, bank_x + 8 * SCALE + 16, MENU_HEIGHT, 8 * SCALE, 8 * SCALE, '>',
+                   lambda: self.turn_bank(1))
+        ]
+
+        for side, x in [('left', MARGIN_LEFT), ('right', RIGHT_PANEL_X)]:
+            self.ui_renderer.page_buttons[side] = [
+                Button(self, x, BOTTOM_PANEL_Y, 8 * SCALE, 8 * SCALE, '<',
+                       lambda side=side: self.turn_page(side, -1)),
+                Button(self, x + 8 * SCALE + 16, BOTTOM_PANEL_Y, 8 * SCALE, 8 * SCALE, '>',
+                       lambda side=side: self.turn_page(side, 1))
+            ]
+
     def initialize_panels(self) -> None:
         """
-        Initializes the panels in the UI.
+        Initializes the panels in the UI. The metatile and metametatile panels get
+        one page of sprites each and the room panel a single sprite, whatever the
+        size of the tables.
         """
         self.tiles = Tiles(self, MARGIN_LEFT, PANEL_Y)
 
         tile_size = 16 * SCALE
 
-        for i in range(48):
+        for i in range(PAGE_SIZE):
             offset_x = i % 6 * tile_size
             offset_y = i // 6 * tile_size
             x = RIGHT_PANEL_X + offset_x
             y = PANEL_Y + offset_y
             self.ui_renderer.metatile_sprites.append(MetaTile(self, x, y, i))
 
-        for i in range(48):
+        for i in range(PAGE_SIZE):
             offset_x = i % 6 * tile_size
             offset_y = i // 6 * tile_size
             x = RIGHT_PANEL_X + offset_x
@@ -116,10 +169,11 @@ class App:
             self.ui_renderer.metametatile_sprites.append(
                 MetaMetaTile(self, x, y, i))
 
-        for i in range(48):
-            x = RIGHT_PANEL_X
-            y = PANEL_Y
-            self.ui_renderer.room_sprites.append(Room(self, x, y, i))
+        self.ui_renderer.room_sprite = Room(self, RIGHT_PANEL_X, PANEL_Y, self.active_room)
+        self.world_map = WorldMap(self, MARGIN_LEFT, PANEL_Y, SCREEN_WIDTH - 2 * MARGIN_LEFT,
+                                  SCREEN_HEIGHT - PANEL_Y - MARGIN_LEFT, self.map_columns)
+        self.room_overview = RoomOverview(self, MARGIN_LEFT, PANEL_Y, SCREEN_WIDTH - 2 * MARGIN_LEFT,
+                                          SCREEN_HEIGHT - PANEL_Y - MARGIN_LEFT)
 
     def initialize_colors(self) -> None:
         """
@@ -145,130 +199,226 @@ class App:
             y = BOTTOM_PANEL_Y + 8 * SCALE + offset_y
             self.all_colors.append(ColorTile(self, x, y, i))
 
+    def update_palette_lut(self) -> None:
+        """
+        Rebuilds the RGB lookup table after the palettes have changed.
+        """
+        self.palette_lut = build_palette_lut(self.project.palettes)
+
     def increase_room(self) -> None:
         """
         Increases the active room index.
         """
         if self.mode == 'rooms':
-            self.active_room = (self.active_room + 1) % 48
-            self.text_right = self.font.render(
-                f'Room {self.active_room}', True, WHITE)
+            self.show_room((self.active_room + 1) % len(self.project.rooms))
 
     def decrease_room(self) -> None:
         """
         Decreases the active room index.
         """
         if self.mode == 'rooms':
-            self.active_room = (self.active_room - 1) % 48
-            self.text_right = self.font.render(
-                f'Room {self.active_room}', True, WHITE)
+            self.show_room((self.active_room - 1) % len(self.project.rooms))
+
+    def show_room(self, index: int) -> None:
+        """
+        Binds the room panel to another room.
+        """
+        self.active_room = index
+        self.ui_renderer.room_sprite.bind(index)
+        self.needs_redraw = True
+        self.update_titles()
+        self.hit_index.rebuild()
+
+    def page_count(self, table: str) -> int:
+        """
+        Returns the number of pages of the metatile or metametatile table.
+        """
+        return max(1, -(-len(getattr(self.project, table)) // PAGE_SIZE))
+
+    def turn_page(self, side: str, step: int) -> None:
+        """
+        Turns the page of the table shown in the left or right panel.
+        """
+        table = PAGED_PANELS.get(self.mode, {}).get(side)
+        if table is not None:
+            self.show_page(table, (self.pages[table] + step) % self.page_count(table))
+
+    def show_page(self, table: str, page: int) -> None:
+        """
+        Binds the sprites of a panel to the entries on the given page.
+        """
+        self.pages[table] = page
+        for slot, sprite in enumerate(self.ui_renderer.page_sprites(table)):
+            sprite.bind(page * PAGE_SIZE + slot)
+        self.needs_redraw = True
+        self.update_titles()
+        self.hit_index.rebuild()
+
+    def bind_tables(self) -> None:
+        """
+        Binds the panels to the current tables, e.g. after they were loaded or resized.
+        """
+        self.selected_metatile = min(self.selected_metatile, len(self.project.metatiles) - 1)
+        self.selected_metametatile = min(self.selected_metametatile, len(self.project.metametatiles) - 1)
+        self.chr_banks.bind(self.project.table_a, self.project.table_b)
+        self.show_bank(self.selected_bank)
+        for table in self.pages:
+            self.show_page(table, min(self.pages[table], self.page_count(table) - 1))
+        self.show_room(min(self.active_room, len(self.project.rooms) - 1))
+
+    def turn_bank(self, step: int) -> None:
+        """
+        Shows the previous or next CHR bank in the tile panel.
+        """
+        self.show_bank((self.selected_bank + step) % len(self.chr_banks))
+
+    def show_bank(self, bank: int) -> None:
+        """
+        Binds the tile panel to a CHR bank, decoding it if it is shown for the first time.
+        New metatile edits use the tiles of this bank.
+        """
+        self.selected_bank = min(bank, len(self.chr_banks) - 1)
+        self.tiles.raw_tiles = self.chr_banks.table(self.selected_bank)
+        self.invalidator.mark([self.tiles])
+        self.update_titles()
+
+    def rebank_metatile(self) -> None:
+        """
+        Moves the metatile under the mouse to the selected CHR bank. Its tile
+        indices are kept, so all four quadrants then show tiles of that bank.
+        """
+        sprite = self.hovered
+        if self.mode != 'metatiles' or not isinstance(sprite, MetaTile) or not sprite.visible:
+            return
+        if self.project.metatile_banks[sprite.index] != self.selected_bank:
+            self.history.write('metatile_banks', (sprite.index,), self.selected_bank)
+            self.invalidator.mark_metatiles([sprite.index])
+            sprite.bank_warned = False
+
+    def page_title(self, label: str, table: str) -> str:
+        """
+        Returns a panel title with the page number if the table has several pages.
+        """
+        pages = self.page_count(table)
+        if pages == 1:
+            return label
+        return f'{label} {self.pages[table] + 1}/{pages}'
+
+    def map_titles(self) -> Tuple[str, str]:
+        """
+        Returns the titles of the world map: its size and zoom, and the room under the mouse.
+        """
+        world_map = self.world_map
+        left = f'World map {world_map.columns}x{world_map.rows()} at {world_map.zoom:g}x'
+        room = world_map.hover_room if world_map.hover_room is not None else self.active_room
+        return left, f'Room {room}'
+
+    def overview_titles(self) -> Tuple[str, str]:
+        """
+        Returns the titles of the room overview: the rows on display, and the room under the mouse.
+        """
+        overview = self.room_overview
+        last_row = min(overview.row + overview.visible_rows(), overview.rows())
+        left = f'Rooms, rows {overview.row + 1}-{last_row} of {overview.rows()}'
+        room = overview.hover_room if overview.hover_room is not None else self.active_room
+        return left, f'Room {room}'
+
+    def update_titles(self) -> None:
+        """
+        Renders the titles of the left and right panels for the current mode.
+        """
+        left, right = {
+            'tiles': (f'Tiles, bank {self.selected_bank}', ''),
+            'metatiles': (f'Tiles, bank {self.selected_bank}', self.page_title('Metatiles', 'metatiles')),
+            'metametatiles': (self.page_title('Metatiles', 'metatiles'),
+                              self.page_title('Metametatiles', 'metametatiles')),
+            'rooms': (self.page_title('Metametatiles', 'metametatiles'), f'Room {self.active_room}'),
+            'map': self.map_titles(),
+            'overview': self.overview_titles(),
+        }[self.mode]
+        self.text_left = self.font.render(left, True, WHITE)
+        self.text_right = self.font.render(right, True, WHITE)
 
     def export(self) -> None:
         """
-        Exports the data to a JSON file.
-        """
-        serialized = {
-            'palettes': self.palettes,
-            'table_a': self.table_a.tolist(),
-            'table_b': self.table_b.tolist(),
-            'metatiles': self.metatiles,
-            'metatile_palettes': self.metatile_palettes,
-            'metametatiles': self.metametatiles,
-            'rooms': [room.tolist() for room in self.rooms]
-        }
+        Exports the data to a JSON or binary (.chp) project file.
+        """
         try:
             file_path = filedialog.asksaveasfilename(
-                initialdir=self.current_dir, filetypes=[('JSON Files', '*.json')])
+                initialdir=self.current_dir,
+                filetypes=[('JSON Files', '*.json'), ('Binary Projects', '*.chp')])
+            if not file_path:
+                return
             self.current_dir = os.path.dirname(file_path)
-            with open(file_path, 'w', encoding='utf-8') as file:
-                json.dump(serialized, file)
+            self.file_io.write_project(file_path, self.project)
+            self.project_path = file_path
+            self.autosaver.mark_saved()
         except FileNotFoundError:
             print('Could not save file: File not found')
-        except json.JSONDecodeError:
-            print('Could not save file: JSON decode error')
+        except OSError as e:
+            print(f'Could not save file: {e.strerror or e}')
+        except ValueError:
+            print('Could not save file: Value error')
         except TypeError:
             print('Could not save file: Type error')
 
     def import_data(self):
         """
-        Imports data from a JSON file.
+        Imports data from a JSON or binary (.chp) project file.
         """
         try:
             root = tk.Tk()
             root.withdraw()
             root.call('wm', 'attributes', '.', '-topmost', True)
             file_path = filedialog.askopenfilename(
-                initialdir=self.current_dir, filetypes=[('JSON Files', '*.json')])
+                initialdir=self.current_dir,
+                filetypes=[('Project Files', '*.json *.chp'), ('JSON Files', '*.json'), ('Binary Projects', '*.chp')])
             self.current_dir = os.path.dirname(file_path)
-            with open(file_path, 'r', encoding='utf-8') as file:
-                serialized = json.load(file)
-            self.table_a = np.array(serialized['table_a'])
-            self.table_b = np.array(serialized['table_b'])
-            self.metatiles = serialized['metatiles']
-            self.metatile_palettes = serialized['metatile_palettes']
-            self.metametatiles = serialized['metametatiles']
-            self.rooms = [np.array(room) for room in serialized['rooms']]
-            self.palettes = serialized['palettes']
-
-            self.tiles.raw_tiles = self.table_a
-            for metatile in self.ui_renderer.metatile_sprites:
-                metatile.tiles = self.metatiles[metatile.index]
-            for metametatile in self.ui_renderer.metametatile_sprites:
-                metametatile.metatiles = self.metametatiles[metametatile.index]
-            for room in self.ui_renderer.room_sprites:
-                room.metametatiles = self.rooms[room.index]
+            self.load_project(file_path)
         except FileNotFoundError:
             print('Could not load file: File not found')
         except json.JSONDecodeError:
             print('Could not load file: JSON decode error')
+        except ValueError as e:
+            print(f'Could not load file: {e}')
         except TypeError:
             print('Could not load file: Type error')
 
+    def load_project(self, file_path: str) -> None:
+        """
+        Loads a project file and points the sprites at the new data.
+        """
+        self.project = self.file_io.read_project(file_path)
+        self.project_path = file_path
+        self.history.clear()
+        self.update_palette_lut()
+        self.bind_tables()
+        self.invalidator.mark_all()
+        self.autosaver.mark_saved()
+
+    def autosave_path(self) -> str:
+        """
+        Returns the autosave file: next to the current project, or in the current folder.
+        """
+        if self.project_path:
+            return os.path.splitext(self.project_path)[0] + '.autosave.chp'
+        return os.path.join(self.current_dir, AUTOSAVE_FILE)
+
     def write_to_file(self) -> None:
         """
         Exports data to C header files.
         """
         destination_folder = filedialog.askdirectory(initialdir=self.current_dir)
+        if not destination_folder:
+            return
         try:
             self.current_dir = os.path.dirname(destination_folder)
-            with open(os.path.join(destination_folder, 'metatiles.h'), 'w', encoding='utf-8') as file:
-                file.write('const unsigned char metatiles[] = {\n')
-                for i in range(48):
-                    file.write('\t')
-                    for j in range(4):
-                        file.write(f'{self.metatiles[i][j]}, ')
-                    file.write(f'{self.metatile_palettes[i]}, ')
-                    file.write('\n')
-                file.write('};\n\n')
-
-            with open(os.path.join(destination_folder, 'metametatiles.h'), 'w', encoding='utf-8') as file:
-                file.write('const unsigned char metametatiles[] = {\n')
-                for i in range(48):
-                    file.write('\t')
-                    for j in range(4):
-                        file.write(f'{self.metametatiles[i][j]}, ')
-                    file.write('\n')
-                file.write('};\n\n')
-
-            with open(os.path.join(destination_folder, 'rooms.h'), 'w', encoding='utf-8') as file:
-                for i in range(48):
-                    file.write(f'const unsigned char room_{i}[] = ')
-                    file.write('{\n')
-                    for j in range(6):
-                        file.write('\t')
-                        for k in range(8):
-                            file.write(f'{self.rooms[i][j][k]}, ')
-                        file.write('\n')
-                    file.write('};\n\n')
-
-            with open(os.path.join(destination_folder, 'palettes.h'), 'w', encoding='utf-8') as file:
-                file.write('const unsigned char palette_bg[] = {\n')
-                for i in range(4):
-                    file.write('\t')
-                    for j in range(4):
-                        file.write(f'{self.palettes[i][j]}, ')
-                    file.write('\n')
-                file.write('};\n\n')
+            written = self.header_exporter.write(destination_folder, self.project)
+            print(f'Exported headers: {", ".join(written) if written else "no changes"}')
+            if self.header_exporter.removed:
+                print(f'Removed headers: {", ".join(self.header_exporter.removed)}')
+            if self.header_exporter.room_codec != 'none':
+                print(self.header_exporter.size_report())
         except FileNotFoundError:
             print('Could not save files: File not found')
         except NotADirectoryError:
@@ -278,67 +428,141 @@ class App:
         except TypeError:
             print('Could not save files: Type Error')
 
+    def optimize_tables(self) -> None:
+        """
+        Merges duplicate metatiles and metametatiles and compacts their tables.
+        """
+        before = self.project.copy()
+        report = optimize(self.project)
+        self.history.record_changes(before)
+        self.selected_metatile = int(report['metatile_map'][self.selected_metatile])
+        self.selected_metametatile = int(report['metametatile_map'][self.selected_metametatile])
+        self.invalidator.mark_all()
+        print(f'{report["metatile_slots"]} metatile and {report["metametatile_slots"]} '
+              f'metametatile slots free ({report["bytes"]} header bytes reclaimable by resizing the tables)')
+
     def open_chr_file(self) -> None:
         """
-        Opens a CHR file and reads the data.
+        Opens a CHR file of any number of banks. The file is memory-mapped and
+        only the banks on display are decoded.
         """
         try:
             file_path = filedialog.askopenfilename(
                 initialdir=self.current_dir, filetypes=[('CHR Files', '*.chr')])
             self.current_dir = os.path.dirname(file_path)
-            self.table_a, self.table_b = self.file_io.read_file(file_path)
-            self.tiles.raw_tiles = self.table_a
+            banks = ChrBanks.open(self.file_io, file_path)
+            self.chr_banks.close()
+            self.chr_banks = banks
+            self.project.table_a, self.project.table_b = banks.table(0), banks.table(1)
+            self.show_bank(self.selected_bank)
+            print(f'Opened {len(banks)} CHR banks from {os.path.basename(file_path)}')
+            self.history.clear()
+            self.invalidator.mark_all()
+            self.autosaver.mark_saved()
         except FileNotFoundError:
             print('Could not open file: File not found')
+        except IOError as e:
+            print(f'Could not open file: {e.strerror or e}')
+        except ValueError as e:
+            print(f'Could not open file: {e}')
         except TypeError:
             print('Could not open file: Type error')
 
+    def save_chr_file(self) -> None:
+        """
+        Saves every CHR bank to a CHR file.
+        """
+        try:
+            file_path = filedialog.asksaveasfilename(
+                initialdir=self.current_dir, filetypes=[('CHR Files', '*.chr')])
+            if not file_path:
+                return
+            self.current_dir = os.path.dirname(file_path)
+            self.chr_banks.save(file_path)
+        except FileNotFoundError:
+            print('Could not save file: File not found')
+        except IOError:
+            print('Could not save file: IO Error')
+
     def switch_mode_tiles(self) -> None:
         """
         Switches the mode to tiles.
         """
         self.mode = 'tiles'
+        self.update_titles()
+        self.hit_index.rebuild()
 
     def switch_mode_metatiles(self) -> None:
         """
         Switches the mode to metatiles.
         """
         self.mode = 'metatiles'
-        for i in range(48):
+        for i in range(PAGE_SIZE):
             x = 16 + (128 * SCALE) + (i % 6 * 16 * SCALE)
             y = PANEL_Y + i // 6 * 16 * SCALE
             self.ui_renderer.metatile_sprites[i].update_pos(x, y)
-        self.text_left = self.font.render('Tiles', True, WHITE)
-        self.text_right = self.font.render('Metatiles', True, WHITE)
+        self.update_titles()
+        self.hit_index.rebuild()
 
     def switch_mode_metametatiles(self) -> None:
         """
         Switches the mode to metametatiles.
         """
         self.mode = 'metametatiles'
-        for i in range(48):
+        for i in range(PAGE_SIZE):
             x = 8 + (0 * SCALE) + (i % 6 * 16 * SCALE)
             y = PANEL_Y + i // 6 * 16 * SCALE
             self.ui_renderer.metatile_sprites[i].update_pos(x, y)
-        for i in range(48):
+        for i in range(PAGE_SIZE):
             x = 16 + (128 * SCALE) + (i % 6 * 16 * SCALE)
             y = PANEL_Y + i // 6 * 16 * SCALE
             self.ui_renderer.metametatile_sprites[i].update_pos(x, y)
-        self.text_left = self.font.render('Metatiles', True, WHITE)
-        self.text_right = self.font.render('Metametatiles', True, WHITE)
+        self.update_titles()
+        self.hit_index.rebuild()
 
     def switch_mode_rooms(self) -> None:
         """
         Switches the mode to rooms.
         """
         self.mode = 'rooms'
-        for i in range(48):
+        for i in range(PAGE_SIZE):
             x = 8 + (0 * SCALE) + (i % 6 * 16 * SCALE)
             y = PANEL_Y + i // 6 * 16 * SCALE
             self.ui_renderer.metametatile_sprites[i].update_pos(x, y)
-        self.text_left = self.font.render('Metametatiles', True, WHITE)
-        self.text_right = self.font.render(
-            f'Room {self.active_room}', True, WHITE)
+        self.update_titles()
+        self.hit_index.rebuild()
+
+    def switch_mode_map(self) -> None:
+        """
+        Switches the mode to the world map.
+        """
+        self.mode = 'map'
+        self.update_titles()
+        self.hit_index.rebuild()
+
+    def switch_mode_overview(self) -> None:
+        """
+        Switches the mode to the room overview, scrolled to the active room.
+        """
+        self.mode = 'overview'
+        self.room_overview.hover_room = None
+        self.room_overview.scroll_to(self.active_room)
+        self.update_titles()
+        self.hit_index.rebuild()
+
+    def undo(self) -> None:
+        """
+        Reverts the last edit.
+        """
+        if not self.history.undo():
+            print('Nothing to undo')
+
+    def redo(self) -> None:
+        """
+        Repeats the last undone edit.
+        """
+        if not self.history.redo():
+            print('Nothing to redo')
 
     def quit(self) -> None:
         """
@@ -346,46 +570,270 @@ class App:
         """
         self.running = False
 
-    def events(self) -> None:
+    def events(self, block: bool = False, timeout: float = None) -> None:
+        """
+        Handles events in the main loop. If block is set, waits for at least one event,
+        or at most timeout seconds.
         """
-        Handles events in the main loop.
+        events = pygame.event.get()
+        if block and not events:
+            if timeout is None:
+                events = [pygame.event.wait()]
+            else:
+                events = [pygame.event.wait(max(1, int(timeout * 1000)))]
+        with self.profiler.phase('events'):
+            self.handle_events(events)
+
+    def handle_events(self, events: list) -> None:
         """
-        for event in pygame.event.get():
+        Handles a batch of events. Of consecutive mouse motions only the last one is
+        processed; a pending motion is handled before any button event, so a drag
+        ending in the same batch is painted within its stroke.
+        """
+        motion = None
+        for event in events:
+            if event.type == pygame.NOEVENT:
+                continue
+            self.needs_redraw = True
             if event.type == pygame.QUIT:
                 self.running = False
+            if event.type in [pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP] and motion is not None:
+                self.mouse_motion(self.to_canvas(motion.pos), motion.buttons[0])
+                motion = None
             if event.type == pygame.MOUSEBUTTONDOWN:
                 if event.button == 1:
-                    for sprite in self.ui_renderer.all_sprites:
-                        sprite.check_click(event.pos)
+                    pos = self.to_canvas(event.pos)
+                    self.history.begin_stroke()
+                    sprite, cell = self.hit_index.lookup(pos)
+                    self.world_map.start_drag(sprite is self.world_map)
+                    self.press_consumed = False
+                    if sprite is not None:
+                        sprite.check_click(pos)
+                    self.drag_from = None if self.press_consumed else (sprite, cell)
+            elif event.type == pygame.MOUSEBUTTONUP:
+                if event.button == 1:
+                    self.drag_from = None
+                    self.press_consumed = False
+                    self.world_map.dragging = False
+                    self.history.end_stroke()
             elif event.type == pygame.MOUSEMOTION:
-                for sprite in self.ui_renderer.all_sprites:
-                    sprite.check_mouseover(event.pos)
-                    if event.buttons[0]:
-                        sprite.check_click(event.pos)
+                motion = event
+            elif event.type == pygame.VIDEORESIZE:
+                self.window = pygame.display.get_surface()
+                self.update_viewport()
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_F3:
+                    self.profiler.toggle()
+                elif event.mod & pygame.KMOD_CTRL:
+                    if event.key == pygame.K_z and event.mod & pygame.KMOD_SHIFT or event.key == pygame.K_y:
+                        self.redo()
+                    elif event.key == pygame.K_z:
+                        self.undo()
+                    elif event.key == pygame.K_b:
+                        self.rebank_metatile()
+            elif event.type == pygame.MOUSEWHEEL:
+                if self.mode == 'map':
+                    self.world_map.zoom_at(self.to_canvas(pygame.mouse.get_pos()), event.y)
+                elif self.mode == 'overview':
+                    self.room_overview.scroll(-event.y)
+
+        if motion is not None:
+            self.mouse_motion(self.to_canvas(motion.pos), motion.buttons[0])
+
+    def mouse_motion(self, pos: Tuple[int], pressed: bool) -> None:
+        """
+        Handles the last of consecutive mouse motions. While dragging, every cell between
+        the previous and the current position is painted in one batch.
+        """
+        sprite, cell = self.hit_index.lookup(pos)
+        if self.hovered is not None and self.hovered is not sprite:
+            self.hovered.check_mouseover(pos)
+        self.hovered = sprite
+        if sprite is None:
+            self.drag_from = None
+            return
+
+        sprite.check_mouseover(pos)
+        if pressed and not self.press_consumed:
+            painted = False
+            if self.drag_from is not None and self.drag_from[0] is sprite and cell is not None:
+                painted = sprite.paint_cells(line_cells(self.drag_from[1], cell))
+            if not painted:
+                sprite.check_click(pos)
+            self.drag_from = (sprite, cell)
+
+    def consume_press(self) -> None:
+        """
+        Ends the current press for the sprites, e.g. after a click switched the
+        mode: until the button is released, dragging does not click or paint
+        whatever is now under the mouse.
+        """
+        self.press_consumed = True
+        self.drag_from = None
+
+    def update_viewport(self) -> None:
+        """
+        Fits the canvas into the window, keeping its aspect ratio: enlarged by the
+        largest integer factor if the window is big enough, shrunk otherwise. At
+        factor 1 the frame is drawn straight into the window and the canvas is not used.
+        """
+        window_width, window_height = self.window.get_size()
+        factor = min(window_width / SCREEN_WIDTH, window_height / SCREEN_HEIGHT)
+        if factor >= 1:
+            factor = int(factor)
+        width = max(1, int(SCREEN_WIDTH * factor))
+        height = max(1, int(SCREEN_HEIGHT * factor))
+        self.viewport = pygame.Rect((window_width - width) // 2, (window_height - height) // 2, width, height)
+        self.window.fill(BACKGROUND)
+        self.window_view = self.window.subsurface(self.viewport)
+        self.screen = self.window_view if factor == 1 else self.canvas
+        self.scale_factor = factor
+        self.window_dirty = True
+        self.presenter.invalidate_all()
+        self.needs_redraw = True
+
+    def to_canvas(self, pos: Tuple[int]) -> Tuple[int, int]:
+        """
+        Maps a position in the window to the canvas.
+        """
+        return ((pos[0] - self.viewport.x) * SCREEN_WIDTH // self.viewport.width,
+                (pos[1] - self.viewport.y) * SCREEN_HEIGHT // self.viewport.height)
+
+    def present(self, rects: list) -> list:
+        """
+        Copies the repainted rectangles of the screen to the window, scaling them
+        if the canvas is used, and uploads them. Returns the uploaded window rectangles.
+        """
+        if self.screen is self.canvas:
+            if isinstance(self.scale_factor, int):
+                k = self.scale_factor
+                scaled = [pygame.Rect(rect.x * k, rect.y * k, rect.width * k, rect.height * k) for rect in rects]
+                for rect, target in zip(rects, scaled):
+                    pygame.transform.scale(self.canvas.subsurface(rect), target.size, self.window_view.subsurface(target))
+                rects = scaled
+            elif rects:
+                pygame.transform.scale(self.canvas, self.viewport.size, self.window_view)
+                rects = [self.window_view.get_rect()]
+        rects = [rect.move(self.viewport.topleft) for rect in rects]
+        if self.window_dirty:
+            self.window_dirty = False
+            rects = [self.window.get_rect()]
+        if rects:
+            pygame.display.update(rects)
+        return rects
+
+    def color_outline(self) -> pygame.Rect:
+        """
+        Returns the outline around the selected palette color.
+        """
+        return pygame.Rect(self.selected_color_x, self.selected_color_y, 4 * SCALE + 2, 4 * SCALE + 2)
+
+    def drawn_items(self) -> dict:
+        """
+        Returns the screen rectangle of everything drawn in the current mode, keyed by object.
+        """
+        items = self.ui_renderer.drawn_items()
+        items[self.text_left] = self.text_left.get_rect(topleft=(MARGIN_LEFT, MENU_HEIGHT))
+        items[self.text_right] = self.text_right.get_rect(topleft=(RIGHT_PANEL_X, MENU_HEIGHT))
+        if self.mode in ['tiles', 'metatiles']:
+            items[self.palette_text] = self.palette_text.get_rect(topleft=(MARGIN_LEFT, BOTTOM_PANEL_Y))
+            items['color outline'] = self.color_outline()
+        if self.profiler.surfaces:
+            items['hud'] = self.profiler.rect
+        return items
+
+    def draw_layers(self) -> None:
+        """
+        Draws everything in the current mode, within the clip rectangle of the screen.
+        """
+        with self.profiler.phase('blit'):
+            self.screen.fill(BACKGROUND)
+
+        self.ui_renderer.draw_ui()
+
+        with self.profiler.phase('blit'):
+            self.screen.blit(self.text_left, (MARGIN_LEFT, MENU_HEIGHT))
+            self.screen.blit(self.text_right, (RIGHT_PANEL_X, MENU_HEIGHT))
+
+            if self.mode in ['tiles', 'metatiles']:
+                self.screen.blit(self.palette_text,
+                                 (MARGIN_LEFT, BOTTOM_PANEL_Y))
+                pygame.draw.rect(self.screen, WHITE, self.color_outline(), SCALE // 2)
+
+        self.profiler.draw()
+
+    def draw(self) -> None:
+        """
+        Draws one frame. Only the rectangles that changed since the last frame
+        are repainted and uploaded.
+        """
+        self.ui_renderer.update_sprites()
+        if self.mode == 'map':
+            self.presenter.add(self.world_map.rect)
+        elif self.mode == 'overview':
+            self.presenter.add(self.room_overview.rect)
+        hud = self.profiler.prepare()
+        if hud is not None:
+            self.presenter.add(hud)
+
+        rects = self.presenter.collect(self.drawn_items())
+        for rect in rects:
+            self.screen.set_clip(rect)
+            self.draw_layers()
+        self.screen.set_clip(None)
+
+        with self.profiler.phase('flip'):
+            self.presenter.count(self.present(rects))
 
     def run(self) -> None:
         """
-        Main loop of the application.
+        Main loop of the application. Frames are only drawn when something
+        changed, at most fps_cap times per second; otherwise the loop sleeps
+        until the next event arrives or an autosave is due.
         """
         self.running = True
+        self.needs_redraw = True
+        start_time = time.perf_counter()
+        start_cpu = time.process_time()
+        self.autosaver.start()
         while self.running:
-            self.screen.fill((12, 12, 12))
-            self.events()
-
-            self.ui_renderer.render_ui()
+            self.events(block=not self.needs_redraw, timeout=self.autosaver.seconds_until_due())
 
-            self.screen.blit(self.text_left, (MARGIN_LEFT, MENU_HEIGHT))
-            self.screen.blit(self.text_right, (RIGHT_PANEL_X, MENU_HEIGHT))
+            if self.needs_redraw:
+                frame_start = time.process_time()
+                self.draw()
+                self.frame_cpu_time = time.process_time() - frame_start
+                self.frames_drawn += 1
+                self.needs_redraw = False
+                self.profiler.end_frame()
 
-            if self.mode == 'metatiles':
-                self.screen.blit(self.palette_text,
-                                 (MARGIN_LEFT, BOTTOM_PANEL_Y))
-                pygame.draw.rect(self.screen, WHITE, pygame.Rect(
-                    self.selected_color_x, self.selected_color_y, 4 * SCALE + 2, 4*SCALE + 2), SCALE // 2)
+            self.clock.tick(self.fps_cap)
+            self.fps = self.clock.get_fps()
+            self.cpu_time = time.process_time() - start_cpu
+            self.autosaver.poll()
 
-            pygame.display.flip()
+        self.autosaver.stop()
+        wall_time = time.perf_counter() - start_time
+        print(f'Drew {self.frames_drawn} frames in {wall_time:.1f} s, '
+              f'{self.cpu_time:.2f} s CPU ({self.cpu_time / max(wall_time, 1e-9):.1%}), '
+              f'{self.presenter.report()}')
 
 
 if __name__ == '__main__':
-    app = App()
-    app.run()
+    parser = argparse.ArgumentParser(description='Metatile, metametatile and room editor for NES games.')
+    parser.add_argument('--hud', action='store_true', help='show FPS and frame phase timings (toggle with F3)')
+    parser.add_argument('--profile', metavar='FILE', help='record a cProfile of the session to FILE')
+    parser.add_argument('--map-columns', type=int, default=MAP_COLUMNS,
+                        help='number of rooms per row of the world map')
+    args = parser.parse_args()
+    if args.map_columns < 1:
+        parser.error('--map-columns must be at least 1')
+
+    app = App(hud=args.hud, map_columns=args.map_columns)
+    if args.profile:
+        profile = cProfile.Profile()
+        profile.runcall(app.run)
+        profile.dump_stats(args.profile)
+        print(f'Saved profile to {args.profile}; view it with python3 -m pstats {args.profile}')
+    else:
+        app.run()
@@ -0,0 +1,69 @@
+from __future__ import annotations
+from typing import Tuple
+
+import numpy as np
+
+from project import Project
+
+
+METATILE_BYTES = 5
+METATILE_BANK_BYTES = 1
+METAMETATILE_BYTES = 4
+
+
+def dedupe_rows(rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Finds duplicate rows with a hash table in one pass. Returns the unique rows in
+    order of first appearance and, for every input row, the index of its unique row.
+    """
+    first = {}
+    remap = np.empty(len(rows), dtype=np.intp)
+    for i, row in enumerate(map(bytes, rows)):
+        remap[i] = first.setdefault(row, len(first))
+    unique = np.zeros((len(first), rows.shape[1]), dtype=rows.dtype)
+    unique[remap] = rows
+    return unique, remap
+
+
+def compact(unique: np.ndarray, size: int) -> np.ndarray:
+    """
+    Places the unique rows at the start of a table with the original number of slots.
+    """
+    table = np.zeros((size, unique.shape[1]), dtype=unique.dtype)
+    table[:len(unique)] = unique
+    return table
+
+
+def optimize(project: Project) -> dict:
+    """
+    Merges identical metatiles (four tiles, palette and CHR bank) and metametatiles, remaps
+    every reference to them and moves the remaining entries to the front of their
+    tables. The project arrays are updated in place, so sprites keep their views.
+    Returns the number of free slots at the end of each table, the header bytes
+    these slots take (reclaimable by shrinking the tables with Project.resize)
+    and the maps from old to new metatile and metametatile indices. The tables
+    keep their size, so the exported headers do not get smaller by themselves.
+    """
+    metatiles = np.column_stack((project.metatiles, project.metatile_palettes, project.metatile_banks))
+    unique_metatiles, metatile_map = dedupe_rows(metatiles)
+    metatiles = compact(unique_metatiles, len(metatiles))
+
+    metametatiles = metatile_map[project.metametatiles].astype(np.uint8)
+    unique_metametatiles, metametatile_map = dedupe_rows(metametatiles)
+
+    project.metatiles[:] = metatiles[:, :4]
+    project.metatile_palettes[:] = metatiles[:, 4]
+    project.metatile_banks[:] = metatiles[:, 5]
+    project.metametatiles[:] = compact(unique_metametatiles, len(metametatiles))
+    project.rooms[:] = metametatile_map[project.rooms]
+
+    free_metatiles = len(metatiles) - len(unique_metatiles)
+    free_metametatiles = len(metametatiles) - len(unique_metametatiles)
+    metatile_bytes = METATILE_BYTES + (METATILE_BANK_BYTES if project.metatile_banks.any() else 0)
+    return {
+        'metatile_slots': free_metatiles,
+        'metametatile_slots': free_metametatiles,
+        'bytes': free_metatiles * metatile_bytes + free_metametatiles * METAMETATILE_BYTES,
+        'metatile_map': metatile_map,
+        'metametatile_map': metametatile_map,
+    }
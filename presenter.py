@@ -0,0 +1,100 @@
+from __future__ import annotations
+from typing import Dict, Hashable, List
+
+import pygame
+
+from constants import *
+
+
+class Presenter:
+    """
+    Tracks the parts of the screen that changed since the last frame, so that
+    only those are repainted and uploaded with pygame.display.update(rects).
+
+    A rectangle is dirty if a sprite re-rendered its image there (add), or if an
+    item drawn in the last frame (sprite, button, selection, title, ...) is no
+    longer drawn, is new, or moved; the diff of the drawn items is done in
+    collect(). Parts that change without moving, like the world map or the
+    overlay, are added every frame they are drawn. Rectangles inside another
+    one are dropped, and when more than max_rects remain they are merged into
+    their bounding box; with many more than that the containment check is
+    skipped.
+    """
+    def __init__(self, app: App, max_rects: int = DIRTY_RECT_LIMIT) -> None:
+        self.app = app
+        self.max_rects = max_rects
+        self.dirty: List[pygame.Rect] = []
+        self.items: Dict[Hashable, pygame.Rect] = {}
+        self.full = True
+        self.pixels = 0
+        self.total_pixels = 0
+        self.frames = 0
+
+    def add(self, rect: pygame.Rect) -> None:
+        """
+        Marks a screen rectangle as changed.
+        """
+        self.dirty.append(pygame.Rect(rect))
+
+    def invalidate_all(self) -> None:
+        """
+        Repaints the whole screen in the next frame, e.g. after the window was resized.
+        """
+        self.full = True
+
+    def collect(self, items: Dict[Hashable, pygame.Rect]) -> List[pygame.Rect]:
+        """
+        Compares the items drawn in this frame with the last one and returns the
+        rectangles to repaint, clipped to the screen.
+        """
+        screen = self.app.screen.get_rect()
+        items = {key: pygame.Rect(rect) for key, rect in items.items()}
+        for key, rect in items.items():
+            previous = self.items.get(key)
+            if previous != rect:
+                self.dirty.append(rect)
+                if previous is not None:
+                    self.dirty.append(previous)
+        self.dirty += [rect for key, rect in self.items.items() if key not in items]
+        self.items = items
+
+        dirty, self.dirty = self.dirty, []
+        if self.full:
+            self.full = False
+            return [screen]
+        dirty = [rect.clip(screen) for rect in dirty]
+        dirty = [rect for rect in dirty if rect.width and rect.height]
+        if len(dirty) > self.max_rects:
+            return [dirty[0].unionall(dirty[1:])] if len(dirty) > 4 * self.max_rects else self.merge(dirty)
+        return self.merge(dirty)
+
+    def merge(self, rects: List[pygame.Rect]) -> List[pygame.Rect]:
+        """
+        Drops rectangles that lie inside another one, and merges the rest into
+        their bounding box if there are more than max_rects of them.
+        """
+        kept = []
+        for rect in sorted(rects, key=lambda rect: -rect.width * rect.height):
+            if not any(other.contains(rect) for other in kept):
+                kept.append(rect)
+        if len(kept) > self.max_rects:
+            return [kept[0].unionall(kept[1:])]
+        return kept
+
+    def count(self, rects: List[pygame.Rect]) -> None:
+        """
+        Adds the pixels uploaded in a frame to the statistics. Overlapping
+        rectangles are counted twice, as they are uploaded twice.
+        """
+        self.pixels = sum(rect.width * rect.height for rect in rects)
+        self.total_pixels += self.pixels
+        self.frames += 1
+
+    def report(self) -> str:
+        """
+        Returns the average upload per frame, relative to uploading the whole screen.
+        """
+        frames = max(self.frames, 1)
+        full = self.app.screen.get_width() * self.app.screen.get_height()
+        average = self.total_pixels / frames
+        return f'{average:.0f} px uploaded per frame ({average / full:.1%} of the screen)'
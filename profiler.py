@@ -0,0 +1,100 @@
+from __future__ import annotations
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Optional
+
+import pygame
+
+from constants import *
+
+
+NO_PHASE = nullcontext()
+
+
+class FrameProfiler:
+    """
+    Accumulates wall-clock time per named phase of a frame (events, update_arr
+    per sprite class, surface creation and scaling, blits, flip) and keeps a
+    moving average over the last frames. While disabled, phase() returns a
+    shared no-op context, so the instrumented code paths cost next to nothing.
+    """
+    def __init__(self, app: App, enabled: bool = False, smoothing: float = HUD_SMOOTHING) -> None:
+        self.app = app
+        self.enabled = enabled
+        self.smoothing = smoothing
+        self.current: Dict[str, float] = {}
+        self.averages: Dict[str, float] = {}
+        self.font = pygame.font.Font(None, 5 * SCALE)
+        self.surfaces: List[pygame.Surface] = []
+        self.rect = pygame.Rect(0, 0, 0, 0)
+
+    def toggle(self) -> None:
+        self.enabled = not self.enabled
+        self.current.clear()
+        self.averages.clear()
+
+    def phase(self, name: str):
+        """
+        Returns a context manager that adds the time spent inside it to the phase.
+        """
+        if not self.enabled:
+            return NO_PHASE
+        return self._timed(name)
+
+    @contextmanager
+    def _timed(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.current[name] = self.current.get(name, 0.0) + time.perf_counter() - start
+
+    def end_frame(self) -> None:
+        """
+        Folds the times of the finished frame into the moving averages.
+        """
+        if not self.enabled:
+            return
+        for name in set(self.averages) | set(self.current):
+            seconds = self.current.get(name, 0.0)
+            self.averages[name] = self.averages.get(name, seconds) * (1 - self.smoothing) + seconds * self.smoothing
+        self.current.clear()
+
+    def lines(self) -> List[str]:
+        """
+        Returns the text of the overlay: FPS and the average time of every phase.
+        """
+        lines = [f'FPS {self.app.fps:.1f}  frame {self.app.frame_cpu_time * 1000:.2f} ms CPU',
+                 f'uploaded {self.app.presenter.pixels} px']
+        for name, seconds in sorted(self.averages.items(), key=lambda item: -item[1]):
+            lines.append(f'{name} {seconds * 1000:.3f} ms')
+        return lines
+
+    def prepare(self) -> Optional[pygame.Rect]:
+        """
+        Renders the text of the overlay for the next frame and returns the
+        rectangle it covers in the bottom right corner of the screen.
+        """
+        if not self.enabled:
+            self.surfaces = []
+            return None
+        self.surfaces = [self.font.render(line, True, WHITE) for line in self.lines()]
+        width = max(surface.get_width() for surface in self.surfaces) + 2 * SPACING
+        height = sum(surface.get_height() for surface in self.surfaces) + 2 * SPACING
+        self.rect = pygame.Rect(SCREEN_WIDTH - width - MARGIN_LEFT, SCREEN_HEIGHT - height - MARGIN_LEFT,
+                                width, height)
+        return self.rect
+
+    def draw(self) -> None:
+        """
+        Draws the overlay prepared for this frame.
+        """
+        if not self.surfaces:
+            return
+        background = pygame.Surface(self.rect.size, pygame.SRCALPHA)
+        background.fill((0, 0, 0, 192))
+        self.app.screen.blit(background, self.rect)
+        y = self.rect.y + SPACING
+        for surface in self.surfaces:
+            self.app.screen.blit(surface, (self.rect.x + SPACING, y))
+            y += surface.get_height()
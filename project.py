@@ -0,0 +1,105 @@
+from __future__ import annotations
+from typing import List
+
+import numpy as np
+
+from constants import *
+
+
+DEFAULT_PALETTES = [
+    [0x0f, 0x01, 0x11, 0x21],
+    [0x0f, 0x05, 0x15, 0x25],
+    [0x0f, 0x08, 0x18, 0x28],
+    [0x0f, 0x0a, 0x1a, 0x2a]
+]
+
+
+class Project:
+    """
+    Project data backed by fixed-dtype uint8 arrays: palettes (4 x 4 NES color
+    indices), the two 128 x 128 pattern tables, metatiles (M x 4 tile indices),
+    metatile palettes (M), metametatiles (N x 4 metatile indices), rooms
+    (R x 6 x 8 metametatile indices) and the CHR bank of each metatile (M).
+    Banks 0 and 1 are table_a and table_b; the others come from the CHR file.
+    Sprites hold views into these arrays, so edits are made in place; operations
+    that change the size of a table replace the array and the sprites have to be
+    bound again.
+    """
+    __slots__ = ('palettes', 'table_a', 'table_b', 'metatiles', 'metatile_palettes', 'metametatiles', 'rooms',
+                 'metatile_banks')
+
+    def __init__(self, palettes, table_a, table_b, metatiles, metatile_palettes, metametatiles, rooms,
+                 metatile_banks=None) -> None:
+        self.palettes = np.asarray(palettes, dtype=np.uint8).reshape(-1, 4)
+        self.table_a = np.asarray(table_a, dtype=np.uint8).reshape(128, 128)
+        self.table_b = np.asarray(table_b, dtype=np.uint8).reshape(128, 128)
+        self.metatiles = np.asarray(metatiles, dtype=np.uint8).reshape(-1, 4)
+        self.metatile_palettes = np.asarray(metatile_palettes, dtype=np.uint8).reshape(-1)
+        self.metametatiles = np.asarray(metametatiles, dtype=np.uint8).reshape(-1, 4)
+        self.rooms = np.asarray(rooms, dtype=np.uint8).reshape(-1, 6, 8)
+        if metatile_banks is None:
+            metatile_banks = np.zeros(len(self.metatiles))
+        self.metatile_banks = np.asarray(metatile_banks, dtype=np.uint8).reshape(-1)
+
+    @classmethod
+    def empty(cls, metatiles: int = METATILE_COUNT, metametatiles: int = METAMETATILE_COUNT,
+              rooms: int = ROOM_COUNT) -> Project:
+        """
+        Returns a project with the default palettes and empty tables.
+        """
+        return cls(DEFAULT_PALETTES, np.zeros((128, 128)), np.zeros((128, 128)), np.zeros((metatiles, 4)),
+                   np.zeros(metatiles), np.zeros((metametatiles, 4)), np.zeros((rooms, 6, 8)))
+
+    def copy(self) -> Project:
+        """
+        Returns a deep copy, e.g. for saving on another thread.
+        """
+        return Project(*(getattr(self, name).copy() for name in self.__slots__))
+
+    def hex_palettes(self) -> List[List[str]]:
+        """
+        Returns the palettes as hex strings, as used in the JSON format and the C headers.
+        """
+        return [[f'0x{color:02x}' for color in palette] for palette in self.palettes.tolist()]
+
+    def check_sizes(self) -> None:
+        """
+        Checks that the tables hold between 1 and the maximum number of entries
+        and that every reference points into its table.
+        """
+        for name, limit in [('metatiles', MAX_METATILES), ('metametatiles', MAX_METAMETATILES), ('rooms', MAX_ROOMS)]:
+            count = len(getattr(self, name))
+            if not 1 <= count <= limit:
+                raise ValueError(f'Project has {count} {name}, expected 1 to {limit}')
+        if len(self.metatile_palettes) != len(self.metatiles) or len(self.metatile_banks) != len(self.metatiles):
+            raise ValueError('Project has a different number of metatiles and metatile palettes or banks')
+        if (self.metametatiles >= len(self.metatiles)).any() or (self.rooms >= len(self.metametatiles)).any():
+            raise ValueError('Project references a metatile or metametatile that does not exist')
+
+    def resize(self, metatiles: int, metametatiles: int, rooms: int) -> None:
+        """
+        Grows or shrinks the metatile, metametatile and room tables. New entries
+        are empty and references to removed entries are reset to 0.
+        """
+        for name, count, limit in [('metatiles', metatiles, MAX_METATILES),
+                                   ('metametatiles', metametatiles, MAX_METAMETATILES),
+                                   ('rooms', rooms, MAX_ROOMS)]:
+            if not 1 <= count <= limit:
+                raise ValueError(f'Number of {name} must be between 1 and {limit}')
+
+        self.metatiles = resized(self.metatiles, metatiles)
+        self.metatile_palettes = resized(self.metatile_palettes, metatiles)
+        self.metatile_banks = resized(self.metatile_banks, metatiles)
+        self.metametatiles = resized(self.metametatiles, metametatiles)
+        self.metametatiles[self.metametatiles >= metatiles] = 0
+        self.rooms = resized(self.rooms, rooms)
+        self.rooms[self.rooms >= metametatiles] = 0
+
+
+def resized(arr: np.ndarray, count: int) -> np.ndarray:
+    """
+    Returns a copy of the array with count entries, padded with zeros.
+    """
+    result = np.zeros((count,) + arr.shape[1:], dtype=arr.dtype)
+    result[:min(count, len(arr))] = arr[:count]
+    return result
@@ -0,0 +1,176 @@
+from __future__ import annotations
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+import pygame
+
+from composer import compose_rooms
+from constants import *
+
+
+class RoomOverview:
+    """
+    Grid of room thumbnails, columns rooms per row, scrolled one row per mouse
+    wheel step. Clicking a thumbnail opens the room in Rooms mode.
+
+    Thumbnails are kept at 1/factor of the room size in one array and marked
+    stale by the invalidator when the room or anything it is built from changes.
+    Stale thumbnails are recomposed lazily, in one batch, when they scroll into
+    view. The visible grid is drawn on a canvas that is kept between frames, so
+    only the slots whose thumbnail changed are scaled and blitted again.
+    """
+    def __init__(self, app: App, x: int, y: int, width: int, height: int,
+                 columns: int = MAP_COLUMNS, factor: int = THUMBNAIL_FACTOR) -> None:
+        self.app = app
+        self.rect = pygame.Rect(x, y, width, height)
+        self.columns = columns
+        self.factor = factor
+        self.thumbnail_size = (ROOM_WIDTH // factor * SCALE, ROOM_HEIGHT // factor * SCALE)
+        self.canvas = pygame.Surface(self.rect.size)
+        self.canvas.fill(BACKGROUND)
+        self.slots = {}
+        self.thumbnails = None
+        self.stale = None
+        self.row = 0
+        self.hover_room = None
+        self.rooms_composed = 0
+
+    def pitch(self) -> Tuple[int, int]:
+        """
+        Returns the distance between two thumbnails on screen.
+        """
+        return self.thumbnail_size[0] + SPACING, self.thumbnail_size[1] + SPACING
+
+    def visible_rows(self) -> int:
+        return max(1, self.rect.height // self.pitch()[1])
+
+    def rows(self) -> int:
+        return -(-len(self.app.project.rooms) // self.columns)
+
+    def scroll(self, step: int) -> None:
+        """
+        Scrolls the grid by step rows.
+        """
+        row = min(max(self.row + step, 0), max(self.rows() - self.visible_rows(), 0))
+        if row != self.row:
+            self.row = row
+            self.app.update_titles()
+
+    def scroll_to(self, index: int) -> None:
+        """
+        Scrolls the grid so that the room is visible.
+        """
+        row = index // self.columns
+        if not self.row <= row < self.row + self.visible_rows():
+            self.row = 0
+            self.scroll(row - self.visible_rows() // 2)
+
+    def visible_rooms(self) -> List[int]:
+        """
+        Returns the indices of the rooms on the visible rows.
+        """
+        first = self.row * self.columns
+        return list(range(first, min(first + self.visible_rows() * self.columns, len(self.app.project.rooms))))
+
+    def room_rect(self, index: int) -> pygame.Rect:
+        """
+        Returns the screen rectangle of a visible room's thumbnail.
+        """
+        pitch_x, pitch_y = self.pitch()
+        slot = index - self.row * self.columns
+        return pygame.Rect(self.rect.x + slot % self.columns * pitch_x, self.rect.y + slot // self.columns * pitch_y,
+                           *self.thumbnail_size)
+
+    def room_at(self, pos: Tuple[int]) -> Optional[int]:
+        """
+        Returns the index of the room whose thumbnail is under the position, if any.
+        """
+        pitch_x, pitch_y = self.pitch()
+        column = (pos[0] - self.rect.x) // pitch_x
+        row = (pos[1] - self.rect.y) // pitch_y
+        index = (self.row + row) * self.columns + column
+        if (0 <= column < self.columns and 0 <= row < self.visible_rows()
+                and index < len(self.app.project.rooms) and self.room_rect(index).collidepoint(pos)):
+            return index
+        return None
+
+    def refresh(self, indices: Iterable[int]) -> None:
+        """
+        Recomposes the stale thumbnails among the given rooms in a single call.
+        """
+        rooms = self.app.project.rooms
+        if self.thumbnails is None or len(self.thumbnails) != len(rooms):
+            width, height = ROOM_WIDTH // self.factor, ROOM_HEIGHT // self.factor
+            self.thumbnails = np.zeros((len(rooms), width, height, 3), dtype=np.uint8)
+            self.stale = np.ones(len(rooms), dtype=bool)
+            self.slots.clear()
+
+        indices = np.asarray(list(indices), dtype=int)
+        indices = indices[self.stale[indices]]
+        if not len(indices):
+            return
+        arr = compose_rooms(self.app.project, self.app.palette_lut, rooms[indices],
+                            self.app.chr_banks).astype(np.uint16)
+        n, width, height = arr.shape[:3]
+        arr = arr.reshape(n, width // self.factor, self.factor, height // self.factor, self.factor, 3)
+        self.thumbnails[indices] = arr.mean(axis=(2, 4)).astype(np.uint8)
+        self.stale[indices] = False
+        self.rooms_composed += n
+        changed = set(indices.tolist())
+        self.slots = {slot: room for slot, room in self.slots.items() if room not in changed}
+
+    def invalidate(self, indices: Iterable[int]) -> None:
+        """
+        Marks the thumbnails of rooms whose contents changed as stale.
+        """
+        if self.stale is not None:
+            indices = [int(index) for index in indices if index < len(self.stale)]
+            self.stale[indices] = True
+
+    def clear(self) -> None:
+        self.thumbnails = None
+        self.stale = None
+        self.slots.clear()
+
+    def check_click(self, pos: Tuple[int]) -> None:
+        """
+        Opens the room under the mouse in Rooms mode. The press ends there, so
+        dragging on does not paint into the room that now lies under the mouse.
+        """
+        room = self.room_at(pos)
+        if room is not None:
+            self.app.show_room(room)
+            self.app.switch_mode_rooms()
+            self.app.consume_press()
+
+    def check_mouseover(self, pos: Tuple[int]) -> None:
+        room = self.room_at(pos) if self.rect.collidepoint(pos) else None
+        if room != self.hover_room:
+            self.hover_room = room
+            self.app.update_titles()
+
+    def draw(self) -> None:
+        """
+        Draws the visible thumbnails and outlines the active and the hovered room.
+        """
+        visible = self.visible_rooms()
+        self.refresh(visible)
+        slot_count = self.visible_rows() * self.columns
+        for slot in range(slot_count):
+            index = self.row * self.columns + slot
+            room = index if index < len(self.thumbnails) else None
+            if slot in self.slots and self.slots[slot] == room:
+                continue
+            rect = self.room_rect(index).move(-self.rect.x, -self.rect.y)
+            if room is None:
+                self.canvas.fill(BACKGROUND, rect)
+            else:
+                self.canvas.blit(pygame.transform.scale(
+                    pygame.surfarray.make_surface(self.thumbnails[room]), self.thumbnail_size), rect)
+            self.slots[slot] = room
+
+        screen = self.app.screen
+        screen.blit(self.canvas, self.rect)
+        for index, color in [(self.hover_room, (128, 128, 128)), (self.app.active_room, WHITE)]:
+            if index is not None and index in visible:
+                pygame.draw.rect(screen, color, self.room_rect(index), 2)
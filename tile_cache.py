@@ -0,0 +1,114 @@
+from __future__ import annotations
+from collections import OrderedDict
+from typing import Iterable, Tuple
+
+import numpy as np
+
+from constants import *
+from entities import colorize
+
+
+class TileCache:
+    """
+    LRU cache of colorized 8x8 tiles keyed by (CHR bank, tile index, palette index).
+    """
+    def __init__(self, app: App, max_size: int = TILE_CACHE_SIZE) -> None:
+        self.app = app
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def table(self, table_index: int) -> np.ndarray:
+        """
+        Returns the pattern table of the given CHR bank.
+        """
+        return self.app.chr_banks.table(table_index)
+
+    def get(self, table_index: int, tile_index: int, palette_index: int) -> np.ndarray:
+        """
+        Returns the colorized tile as an (8, 8, 3) uint8 array in surfarray layout.
+        """
+        key = (table_index, tile_index, palette_index)
+        arr = self.entries.get(key)
+        if arr is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return arr
+
+        self.misses += 1
+        y = tile_index // 16 * 8
+        x = tile_index % 16 * 8
+        arr = colorize(self.table(table_index)[y:y+8, x:x+8], self.app.palette_lut, palette_index)
+        self.entries[key] = arr
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        return arr
+
+    def compose_metatile(self, tiles: Iterable[int], palette_index: int, table_index: int = 0) -> np.ndarray:
+        """
+        Composes a (16, 16, 3) metatile from four cached tiles.
+        """
+        arr = np.empty((METATILE_SIZE, METATILE_SIZE, 3), dtype=np.uint8)
+        for i, tile in enumerate(tiles):
+            arr_x = i % 2 * 8
+            arr_y = i // 2 * 8
+            arr[arr_x:arr_x+8, arr_y:arr_y+8] = self.get(table_index, tile, palette_index)
+        return arr
+
+    def compose_metametatile(self, metatile_indices: Iterable[int]) -> np.ndarray:
+        """
+        Composes a (32, 32, 3) metametatile from four metatiles of the project.
+        """
+        arr = np.empty((METAMETATILE_SIZE, METAMETATILE_SIZE, 3), dtype=np.uint8)
+        for i, metatile in enumerate(metatile_indices):
+            arr_x = i % 2 * 16
+            arr_y = i // 2 * 16
+            arr[arr_x:arr_x+16, arr_y:arr_y+16] = self.compose_metatile(
+                self.app.project.metatiles[metatile], self.app.project.metatile_palettes[metatile],
+                self.app.project.metatile_banks[metatile])
+        return arr
+
+    def compose_room(self, room: np.ndarray) -> np.ndarray:
+        """
+        Composes a (256, 192, 3) room from its 6x8 grid of metametatiles.
+        """
+        arr = np.empty((ROOM_WIDTH, ROOM_HEIGHT, 3), dtype=np.uint8)
+        for i in range(6):
+            for j in range(8):
+                arr_x = j * 32
+                arr_y = i * 32
+                arr[arr_x:arr_x+32, arr_y:arr_y+32] = self.compose_metametatile(
+                    self.app.project.metametatiles[room[i][j]])
+        return arr
+
+    def invalidate_tiles(self, table_index: int, tile_indices: Iterable[int]) -> None:
+        """
+        Drops every colorization of the given tiles.
+        """
+        tile_indices = set(int(i) for i in tile_indices)
+        self._drop(key for key in self.entries if key[0] == table_index and key[1] in tile_indices)
+
+    def invalidate_palette(self, palette_index: int) -> None:
+        """
+        Drops every tile colorized with the given palette.
+        """
+        self._drop(key for key in self.entries if key[2] == palette_index)
+
+    def clear(self) -> None:
+        """
+        Drops all entries, e.g. after the pattern tables were replaced.
+        """
+        self.entries.clear()
+
+    def stats(self) -> Tuple[int, int, int, int]:
+        """
+        Returns (size, hits, misses, evictions).
+        """
+        return len(self.entries), self.hits, self.misses, self.evictions
+
+    def _drop(self, keys: Iterable[Tuple[int, int, int]]) -> None:
+        for key in list(keys):
+            del self.entries[key]
@@ -1,51 +1,148 @@
 from __future__ import annotations
+from typing import Optional
 
 import pygame
 
 
+PAGED_PANELS = {
+    'metatiles': {'right': 'metatiles'},
+    'metametatiles': {'left': 'metatiles', 'right': 'metametatiles'},
+    'rooms': {'left': 'metametatiles'},
+}
+
+
 class UIRenderer:
     """
     UIRenderer class is responsible for rendering the UI elements of the application.
+    The metatile and metametatile panels hold one page of sprites each, which are
+    bound to the entries of the page on display.
     """
     def __init__(self, app: App) -> None:
         self.app = app
         self.tile_sprites = []
-        self.room_sprites = []
+        self.room_sprite = None
         self.menu_buttons = []
         self.arrow_buttons = []
+        self.bank_buttons = []
+        self.page_buttons = {'left': [], 'right': []}
         self.metatile_sprites = []
         self.metametatile_sprites = []
         self.all_sprites = []
 
-    def render_ui(self) -> None:
+    def page_sprites(self, table: str) -> list:
         """
-        Renders the UI elements of the application.
+        Returns the sprites of the panel showing the given table.
         """
-        if self.app.mode in ['tiles', 'metatiles']:
-            for sprite in self.tile_sprites:
-                sprite.update()
-                sprite.draw()
+        return self.metatile_sprites if table == 'metatiles' else self.metametatile_sprites
+
+    def sprite_for(self, table: str, index: int) -> Optional[object]:
+        """
+        Returns the sprite showing an entry of the table, or None if it is not on the current page.
+        """
+        sprites = self.page_sprites(table)
+        slot = index - self.app.pages[table] * len(sprites)
+        if 0 <= slot < len(sprites):
+            return sprites[slot]
+        return None
+
+    def active_page_buttons(self) -> list:
+        """
+        Returns the page buttons of the panels in the current mode that have more than one page.
+        """
+        buttons = []
+        for side, table in PAGED_PANELS.get(self.app.mode, {}).items():
+            if self.app.page_count(table) > 1:
+                buttons += self.page_buttons[side]
+        return buttons
 
+    def interactive_sprites(self) -> list:
+        """
+        Returns the sprites that react to the mouse in the current mode.
+        """
+        sprites = list(self.menu_buttons)
+        if self.app.mode in ['tiles', 'metatiles']:
+            sprites += self.tile_sprites
+            sprites += self.bank_buttons
         if self.app.mode in ['metametatiles', 'rooms']:
-            for sprite in self.metametatile_sprites:
-                sprite.update()
-                sprite.draw()
+            sprites += [sprite for sprite in self.metametatile_sprites if sprite.visible]
+        if self.app.mode in ['metatiles', 'metametatiles']:
+            sprites += [sprite for sprite in self.metatile_sprites if sprite.visible]
+        if self.app.mode == 'rooms':
+            sprites.append(self.room_sprite)
+            sprites += self.arrow_buttons
+        if self.app.mode == 'map':
+            sprites.append(self.app.world_map)
+        if self.app.mode == 'overview':
+            sprites.append(self.app.room_overview)
+        sprites += self.active_page_buttons()
+        return sprites
 
+    def visible_sprites(self) -> list:
+        """
+        Returns the tile sprites drawn in the current mode, in drawing order.
+        """
+        sprites = []
+        if self.app.mode in ['tiles', 'metatiles']:
+            sprites += self.tile_sprites
+        if self.app.mode in ['metametatiles', 'rooms']:
+            sprites += [sprite for sprite in self.metametatile_sprites if sprite.visible]
         if self.app.mode in ['metatiles', 'metametatiles']:
-            for sprite in self.metatile_sprites:
-                sprite.update()
-                sprite.draw()
+            sprites += [sprite for sprite in self.metatile_sprites if sprite.visible]
+        if self.app.mode == 'rooms':
+            sprites.append(self.room_sprite)
+        return sprites
 
+    def visible_buttons(self) -> list:
+        """
+        Returns the buttons drawn in the current mode.
+        """
+        buttons = list(self.menu_buttons)
+        if self.app.mode in ['tiles', 'metatiles']:
+            buttons += self.bank_buttons
         if self.app.mode == 'rooms':
-            self.room_sprites[self.app.active_room].update()
-            self.room_sprites[self.app.active_room].draw()
+            buttons += self.arrow_buttons
+        return buttons + self.active_page_buttons()
+
+    def update_sprites(self) -> None:
+        """
+        Brings the images of the visible sprites up to date. Sprites whose image
+        changed report their rectangle to the presenter.
+        """
+        for sprite in self.visible_sprites():
+            sprite.update()
 
-        if self.app.mode != 'tiles':
-            self.app.screen.blit(self.app.selection.image, self.app.selection.rect)
+    def drawn_items(self) -> dict:
+        """
+        Returns the screen rectangle of everything draw_ui draws, keyed by object.
+        """
+        items = {sprite: sprite.rect for sprite in self.visible_sprites()}
+        items.update((button, button.rect) for button in self.visible_buttons())
+        if self.app.mode == 'map':
+            items[self.app.world_map] = self.app.world_map.rect
+        if self.app.mode == 'overview':
+            items[self.app.room_overview] = self.app.room_overview.rect
+        if self.app.mode not in ['tiles', 'map', 'overview']:
+            items['selection'] = self.app.selection.rect
+        return items
+
+    def draw_ui(self) -> None:
+        """
+        Draws the UI elements of the current mode.
+        """
+        for sprite in self.visible_sprites():
+            sprite.draw()
 
-        for button in self.menu_buttons:
-            button.draw()
+        if self.app.mode == 'map':
+            with self.app.profiler.phase('draw WorldMap'):
+                self.app.world_map.draw()
 
-        if self.app.mode == 'rooms':
-            for button in self.arrow_buttons:
+        if self.app.mode == 'overview':
+            with self.app.profiler.phase('draw RoomOverview'):
+                self.app.room_overview.draw()
+
+        with self.app.profiler.phase('blit'):
+            if self.app.mode not in ['tiles', 'map', 'overview']:
+                self.app.screen.blit(self.app.selection.image, self.app.selection.rect)
+
+            for button in self.visible_buttons():
                 button.draw()
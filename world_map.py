@@ -0,0 +1,208 @@
+from __future__ import annotations
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+import pygame
+
+from constants import *
+
+
+class WorldMap:
+    """
+    Scrollable, zoomable view of all rooms laid out on a grid, columns rooms per row.
+    Only the rooms inside the viewport are composed and blitted. Rooms are built
+    from metametatile cells that are scaled once per zoom level, and the room
+    surfaces are kept in an LRU cache until the room or the zoom level changes.
+    """
+    def __init__(self, app: App, x: int, y: int, width: int, height: int,
+                 columns: int = MAP_COLUMNS, max_rooms: int = MAP_CACHE_SIZE) -> None:
+        self.app = app
+        self.rect = pygame.Rect(x, y, width, height)
+        self.columns = columns
+        self.max_rooms = max_rooms
+        self.zoom_index = MAP_ZOOM_LEVELS.index(MAP_ZOOM)
+        self.view_x = 0.0
+        self.view_y = 0.0
+        self.surfaces = OrderedDict()
+        self.cells = {}
+        self.drag_pos = None
+        self.dragging = False
+        self.hover_room = None
+        self.rooms_drawn = 0
+        self.rooms_composed = 0
+
+    @property
+    def zoom(self) -> float:
+        return MAP_ZOOM_LEVELS[self.zoom_index]
+
+    def rows(self) -> int:
+        return -(-len(self.app.project.rooms) // self.columns)
+
+    def room_size(self) -> Tuple[int, int]:
+        """
+        Returns the on-screen size of one room at the current zoom level.
+        """
+        return int(ROOM_WIDTH * self.zoom), int(ROOM_HEIGHT * self.zoom)
+
+    def origin(self) -> Tuple[int, int]:
+        """
+        Returns the position of the viewport in screen pixels of the whole map.
+        """
+        return int(self.view_x * self.zoom), int(self.view_y * self.zoom)
+
+    def clamp_view(self) -> None:
+        """
+        Keeps the viewport inside the map. The view position is kept in room pixels.
+        """
+        max_x = self.columns * ROOM_WIDTH - self.rect.width / self.zoom
+        max_y = self.rows() * ROOM_HEIGHT - self.rect.height / self.zoom
+        self.view_x = min(max(self.view_x, 0.0), max(max_x, 0.0))
+        self.view_y = min(max(self.view_y, 0.0), max(max_y, 0.0))
+
+    def pan(self, dx: int, dy: int) -> None:
+        """
+        Moves the map by a distance in screen pixels.
+        """
+        self.view_x -= dx / self.zoom
+        self.view_y -= dy / self.zoom
+        self.clamp_view()
+
+    def zoom_at(self, pos: Tuple[int], step: int) -> None:
+        """
+        Changes the zoom level by step levels, keeping the point under pos in place.
+        """
+        zoom_index = min(max(self.zoom_index + step, 0), len(MAP_ZOOM_LEVELS) - 1)
+        if zoom_index == self.zoom_index:
+            return
+        anchor_x = self.view_x + (pos[0] - self.rect.x) / self.zoom
+        anchor_y = self.view_y + (pos[1] - self.rect.y) / self.zoom
+        self.zoom_index = zoom_index
+        self.view_x = anchor_x - (pos[0] - self.rect.x) / self.zoom
+        self.view_y = anchor_y - (pos[1] - self.rect.y) / self.zoom
+        self.clamp_view()
+        self.clear()
+        self.app.update_titles()
+
+    def room_at(self, pos: Tuple[int]) -> Optional[int]:
+        """
+        Returns the index of the room under the position, if any.
+        """
+        width, height = self.room_size()
+        origin_x, origin_y = self.origin()
+        column = (pos[0] - self.rect.x + origin_x) // width
+        row = (pos[1] - self.rect.y + origin_y) // height
+        index = row * self.columns + column
+        if 0 <= column < self.columns and 0 <= index < len(self.app.project.rooms):
+            return index
+        return None
+
+    def visible_rooms(self) -> List[int]:
+        """
+        Returns the indices of the rooms that intersect the viewport.
+        """
+        width, height = self.room_size()
+        origin_x, origin_y = self.origin()
+        columns = range(origin_x // width, min(self.columns, (origin_x + self.rect.width - 1) // width + 1))
+        rows = range(origin_y // height, (origin_y + self.rect.height - 1) // height + 1)
+        return [row * self.columns + column for row in rows for column in columns
+                if row * self.columns + column < len(self.app.project.rooms)]
+
+    def cell(self, index: int) -> pygame.Surface:
+        """
+        Returns the scaled surface of a metametatile.
+        """
+        cell = self.cells.get(index)
+        if cell is None:
+            arr = self.app.tile_cache.compose_metametatile(self.app.project.metametatiles[index])
+            size = int(METAMETATILE_SIZE * self.zoom)
+            cell = pygame.transform.scale(pygame.surfarray.make_surface(arr), (size, size))
+            self.cells[index] = cell
+        return cell
+
+    def surface(self, index: int) -> pygame.Surface:
+        """
+        Returns the scaled surface of a room, composing it on a cache miss.
+        """
+        surface = self.surfaces.get(index)
+        if surface is not None:
+            self.surfaces.move_to_end(index)
+            return surface
+        surface = pygame.Surface(self.room_size())
+        size = int(METAMETATILE_SIZE * self.zoom)
+        for (y, x), metametatile in np.ndenumerate(self.app.project.rooms[index]):
+            surface.blit(self.cell(int(metametatile)), (x * size, y * size))
+        self.surfaces[index] = surface
+        self.rooms_composed += 1
+        return surface
+
+    def invalidate(self, indices: Iterable[int]) -> None:
+        """
+        Drops the cached surfaces of rooms whose contents changed.
+        """
+        for index in indices:
+            self.surfaces.pop(int(index), None)
+
+    def invalidate_metametatiles(self, indices: Iterable[int]) -> None:
+        """
+        Drops the cached cells of metametatiles whose contents changed. The rooms
+        using them are invalidated separately.
+        """
+        for index in indices:
+            self.cells.pop(int(index), None)
+
+    def clear(self) -> None:
+        self.surfaces.clear()
+        self.cells.clear()
+
+    def start_drag(self, on_map: bool) -> None:
+        """
+        Called on every mouse press. Only a drag that starts on the map pans it.
+        """
+        self.dragging = on_map
+        self.drag_pos = None
+
+    def check_click(self, pos: Tuple[int]) -> None:
+        """
+        Selects the room under the mouse when pressed, and pans the map while a
+        drag that started on it goes on, also after leaving and re-entering the map.
+        """
+        if not self.dragging:
+            return
+        if self.drag_pos is not None:
+            self.pan(pos[0] - self.drag_pos[0], pos[1] - self.drag_pos[1])
+        else:
+            room = self.room_at(pos)
+            if room is not None and room != self.app.active_room:
+                self.app.show_room(room)
+        self.drag_pos = pos
+
+    def check_mouseover(self, pos: Tuple[int]) -> None:
+        room = self.room_at(pos) if self.rect.collidepoint(pos) else None
+        if room != self.hover_room:
+            self.hover_room = room
+            self.app.update_titles()
+
+    def draw(self) -> None:
+        """
+        Draws the rooms inside the viewport and outlines the active room.
+        """
+        self.clamp_view()
+        screen = self.app.screen
+        width, height = self.room_size()
+        origin_x, origin_y = self.origin()
+        visible = self.visible_rooms()
+
+        clip = screen.get_clip()
+        screen.set_clip(self.rect.clip(clip))
+        for index in visible:
+            x = self.rect.x + index % self.columns * width - origin_x
+            y = self.rect.y + index // self.columns * height - origin_y
+            screen.blit(self.surface(index), (x, y))
+            if index == self.app.active_room:
+                pygame.draw.rect(screen, WHITE, pygame.Rect(x, y, width, height), 1)
+        screen.set_clip(clip)
+
+        self.rooms_drawn = len(visible)
+        while len(self.surfaces) > max(self.max_rooms, len(visible)):
+            self.surfaces.popitem(last=False)